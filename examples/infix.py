@@ -1,50 +1,41 @@
 """
 Parsing infix expressions that associate left-to-right, like
    5 - 3 - 1 (meaning: (5 - 3) - 1)
-is a little tricky, because the natural way to express it in a
-grammar, like this, doesn't work:
+takes a left-recursive grammar, like this:
 
   expr = expr (-) term   hug
-       | expr
+       | term
   term = (\d+)
 
-This dies with a stack overflow because the recursion
+A plain recursive-descent parser would die here with a stack
+overflow, because the recursion
   expr = expr ...
-precedes any base case.
+precedes any base case. Peglet notices rules like this that call
+themselves first thing, and parses them by growing a seed: first it
+takes `expr` to fail, so the `term` alternative matches `5`; then it
+reparses, taking `expr` to be that, to match `5 - 3`; and so on for
+as long as the match grows.
 
-Moving the recursive call over to the right would fix the problem,
-at the cost of producing the wrong parse tree, a tree like 5-(3-1):
+(Moving the recursive call over to the right would avoid the left
+recursion, at the cost of producing the wrong parse tree, a tree like
+5-(3-1):
 
   expr = term (-) expr   hug
        | term
 
-So the code below instead takes the form
-
-  expr = term ops
-  ops  = (-) term ops
-       | 
-
-plus semantic actions that juggle the values into place. (My
-other parsing library, Parson, can manage without the juggling.)
+That's what we want for right-associative operators like ^ below.)
 """
 
 from peglet import Parser, OneResult, hug
 
-def apply(a, f):   return f(a)
-def rhs(op, b):    return lambda a: (a, op, b)
-def compose(f, g): return lambda a: g(f(a))
-def identity():    return lambda a: a
-
 g = r"""
 top   =  _ exp0 $
 
-exp0  =  exp1 ops0 apply 
-ops0  =  ([+-]) _ exp1 rhs ops0 compose
-      |  identity
+exp0  =  exp0 ([+-]) _ exp1  hug
+      |  exp1
 
-exp1  =  exp2 ops1 apply
-ops1  =  ([*/%]) _ exp2 rhs ops1 compose
-      |  identity
+exp1  =  exp1 ([*/%]) _ exp2 hug
+      |  exp2
 
 exp2 = term (\^) _ exp2      hug
      | term
@@ -72,3 +63,36 @@ calc = OneResult(Parser(g, int=int, **globals()))
 #. (2, '-', (4, '/', 5))
 ## calc('2^3^4')
 #. (2, '^', (3, '^', 4))
+
+
+# The same operators as a table, parsed by precedence climbing: a bare
+# number takes one trip through the loop instead of a call per level.
+
+from peglet import infix
+
+exp = infix('term', ('left',  r'([+-]) _',  hug),
+                    ('left',  r'([*/%]) _', hug),
+                    ('right', r'(\^) _',    hug))
+
+g2 = r"""
+top   =  _ exp $
+
+term  =  (-) _ term          hug
+      |  \( _ exp \) _
+      |  (\d+) _             int
+
+_     =  \s*
+"""
+
+calc2 = OneResult(Parser(g2, int=int, **globals()))
+
+## calc2('3')
+#. 3
+## calc2('5-4-3-2-1')
+#. ((((5, '-', 4), '-', 3), '-', 2), '-', 1)
+## calc2('3-1-(1-2)')
+#. ((3, '-', 1), '-', (1, '-', 2))
+## calc2('2 - 4/5')
+#. (2, '-', (4, '/', 5))
+## calc2('2^3^4 * -1')
+#. ((2, '^', (3, '^', 4)), '*', ('-', 1))
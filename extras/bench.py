@@ -0,0 +1,76 @@
+"""
+Time peglet's engines against each other on a JSON document: the
+tree-walking interpreter, the parsing machine, and compiled source.
+Run it from the top directory as `python extras/bench.py [N]`, where
+N (default 200) is the number of records in the document.
+"""
+
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from peglet import Parser, compile_to_source, hug, join
+
+grammar = r"""
+start    = _ value
+object   = { _ members } _        mk_object
+         | { _ } _                mk_object
+members  = pair , _ members
+         | pair
+pair     = string : _ value       hug
+array    = \[ _ elements \] _     hug
+         | \[ _ \] _              hug
+elements = value , _ elements
+         | value
+value    = string | number
+         | object | array
+         | (true|false|null)\b _  mk_literal
+string   = " chars " _            join
+chars    = char chars
+         |
+char     = ([^\x00-\x1f"\\])
+         | \\(["/\\])
+number   = int frac _        join mk_number
+         | int _             join mk_number
+int      = (-?) (0) !\d
+         | (-?) ([1-9]\d*)
+frac     = ([.]\d+)
+_        = \s*
+"""
+
+mk_object  = lambda *pairs: dict(pairs)
+mk_literal = dict(true=True, false=False, null=None).get
+mk_number  = float
+
+def make_document(n):
+    record = '{"id": %d, "name": "item %d", "tags": ["a", "b"], "ok": true, "x": 1.5}'
+    return '[' + ',\n '.join(record % (i, i) for i in range(n)) + ']'
+
+def timed(parse, text, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = parse(text)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main(argv):
+    sys.setrecursionlimit(100000)  # The grammar is right-recursive.
+    text = make_document(int(argv[0]) if argv else 200)
+    actions = dict(hug=hug, join=join, mk_number=mk_number,
+                   mk_object=mk_object, mk_literal=mk_literal)
+    parsers = [(engine, Parser(grammar, dict(engine=engine), **actions))
+               for engine in ('tree', 'vm')]
+    module = {}
+    exec(compile_to_source(grammar, actions_module=sys.modules[__name__]),
+         module)
+    parsers.append(('compiled', module['parse']))
+    expected = None
+    for name, parse in parsers:
+        elapsed, result = timed(parse, text)
+        assert expected is None or result == expected, name
+        expected = result
+        print('%-10s %8.1f ms' % (name, 1000 * elapsed))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -82,6 +82,9 @@ that's not a defined rule or action name is an error. (So, forgetting
 to define a rule gets you a BadGrammar exception instead of a wrong
 parse.)
 
+A regex token matches at the current position in the whole input,
+as with `pattern.match(text, pos)`: so `\b` and lookbehind can see
+the text before that position, while `^` matches only at the start.
 Matching a regex token that has captures produces a tuple of all the
 captured strings. Matching a sequence of tokens produces the
 concatenation of the results from each. A semantic action takes all
@@ -94,6 +97,34 @@ action, or negated token again. (Thus `!!foo` serves for lookahead: it
 matches when `foo` matches, but again consumes no input and produces
 only `()`.)
 
+A rule name followed by `*`, `+` or `?` matches that rule as many
+times as it will, at least once, or at most once, producing the
+results of each match in turn, without a helper rule to recurse
+through. A group of alternatives in parentheses acts like a rule of
+its own, written in place; its parentheses are tokens too, and the
+closing one may take the same postfix operators. So these are the
+same as `parts` and `part` above:
+
+    >>> some_html = Parser(r"""
+    ... parts = part*
+    ... part  = <(\w+)> part* </\w+>   group
+    ...       | ([^<]+)
+    ... """, group=lambda *values: values)
+    >>> some_html("Hello. <p><em>Nesting</em> for <i>the win</i>.</p>")
+    ('Hello. ', ('p', ('em', 'Nesting'), ' for ', ('i', 'the win'), '.'))
+    >>> Parser(r"csv = (\w+) ( ,\s* (\w+) )*")('a, b, c')
+    ('a', 'b', 'c')
+
+A repetition stops after a match that consumes no input.
+
+A rule may call itself first thing, as left-associative operators
+want; it's parsed by taking the call to fail at first, then to
+produce the previous parse, for as long as that parse grows. (But a
+rule can't get back to itself that way through another rule.)
+
+    >>> Parser(r"expr = expr (-) (\d+) hug | (\d+)", hug=hug)('5-3-1')
+    ((('5', '-', '3'), '-', '1'),)
+
 Actions
 -------
 
@@ -104,31 +135,42 @@ For convenience we supply some commonly-used semantic actions (`hug`,
 being parsed. Special actions like this can be defined by setting
 their `peglet_action` attribute; but the protocol for such actions is
 undocumented.
+
+`infix` makes another kind of action, standing for a whole expression
+grammar: operands separated by operators of several precedence levels,
+parsed by precedence climbing instead of a rule per level.
+
+    >>> calc = Parser(r"expr = ops   num = (\d+) int", int=int,
+    ...               ops=infix('num', ('left', r'([+-])', hug),
+    ...                                ('left', r'([*/])', hug)))
+    >>> calc('1+2*3-4')
+    (((1, '+', (2, '*', 3)), '-', 4),)
 '''
 
-import re
+import array, ast, collections, hashlib, heapq, itertools, os, re, sys, time
 
-def _memo(f):
-    """Return a function like f but caching its results. Its arguments
-    must be hashable."""
-    memos = {}
-    def memoized(*args):
-        try: return memos[args]
-        except KeyError:
-            result = memos[args] = f(*args)
-            return result
-    return memoized
+__version__ = '0.1.2dev'
+
+try: from re import _parser as _sre_parse   # Python 3.11 and up
+except ImportError: import sre_parse as _sre_parse
 
 _identifier = r'[A-Za-z_]\w*'
 
-def Parser(grammar, **actions):
+try: _RecursionError = RecursionError
+except NameError: _RecursionError = RuntimeError # Python 2
+
+def Parser(grammar, options=None, **actions):
     r"""Make a parsing function from a peglet grammar, defining the
-    grammar's semantic actions with keyword arguments.
+    grammar's semantic actions with keyword arguments, and with the
+    options in a dict, if any, as described below.
 
     The parsing function maps a string to a results tuple or raises
     Unparsable. (It can optionally take a rule name to start from, by
     default the first in the grammar.) It doesn't necessarily match
-    the whole input, just a prefix.
+    the whole input, just a prefix. Besides strings, it accepts any
+    buffer the re module can match in place (bytes, bytearray, mmap,
+    and under Python 3 memoryview), against the grammar encoded as
+    UTF-8.
 
     >>> nums = Parser(r"nums = num ,\s* nums | num   num = (\d+) int", int=int)
     >>> nums('42, 137, and 0 are magic numbers')
@@ -136,16 +178,730 @@ def Parser(grammar, **actions):
     >>> nums('The magic numbers are 42, 137, and 0')
     Traceback (most recent call last):
     Unparsable: ('nums', '', 'The magic numbers are 42, 137, and 0')
+    >>> nums(bytearray(b'42, 137'))
+    (42, 137)
+
+    Its iterparse(text, rule) method matches rule over and over, like
+    `rule*`, yielding each match's results as it gets them, instead
+    of collecting them all into one tuple at the end. Each match gets
+    a memo table of its own, freed when it's done. With whole=True,
+    the matches must reach the end of text, or it raises Unparsable.
+
+    >>> words = Parser(r"word = \W*(\w+)")
+    >>> list(words.iterparse('Hi, there.'))
+    [('Hi',), ('there',)]
+    >>> list(words.iterparse('Hi, there.', whole=True))
+    Traceback (most recent call last):
+    Unparsable: ('word', 'Hi, there', '.')
+
+    Its parse_stream(fileobj, rule) method parses a file as a series
+    of records, each a match of rule starting where the last one
+    ended, yielding each record's results in turn. It reads the file
+    in chunks of chunk_size characters (default 65536) as the parse
+    needs them, and lets go of those behind the record it's on. A
+    record counts as done once its parse has stayed lookahead
+    characters (default 4096) short of the end of what's been read,
+    or the file has no more, so no token should look farther than
+    that past where the parse got. Each record must consume some
+    input.
+
+    >>> import io
+    >>> rows = Parser(r"row = field fields \n   fields = , field fields |   field = ([^,\n]*)")
+    >>> for row in rows.parse_stream(io.StringIO(u'a,b\nc,d\n'), chunk_size=4, lookahead=1):
+    ...     print(' '.join(row))
+    a b
+    c d
+    >>> recs = Parser(r"rec = w hug   w = (x) (y+) /z/ | (x)", hug=hug)
+    >>> for ((x, ys),) in recs.parse_stream(io.StringIO(u'x'+u'y'*20+u'z'),
+    ...                                     chunk_size=10, lookahead=4):
+    ...     print(x + ys)
+    xyyyyyyyyyyyyyyyyyyyy
+
+    For input that arrives in pieces, as from a socket, its
+    incremental(rule) method returns a push parser. Its feed(data)
+    method adds data to the input and returns a list of the results
+    of the records that completes; close() does the same for the
+    rest of the input, raising Unparsable if it doesn't parse. A
+    record counts as done as soon as its parse succeeds and stays
+    lookahead characters (default 0) short of the end of the input
+    so far, so each record should end with a delimiter like a
+    newline. A parse that fails waits for more input, until there
+    are more than backlog characters (default 4096) past where it
+    failed. Between feeds, the parse of the record in progress keeps
+    its memo entries, but for those that got within that far of the
+    end. Since a record's completion hangs on how far its parse got
+    even when it succeeds, these parses don't match regular rules as
+    single regexes. parse_async(reader, rule) parses the data from an
+    asyncio StreamReader in the same way, returning an async iterator
+    over the records' results.
+
+    >>> records = Parser(r"line = ([^\n]*) \n").incremental()
+    >>> records.feed('hel')
+    []
+    >>> records.feed('lo\nworld\nbye')
+    [('hello',), ('world',)]
+    >>> records.close()
+    Traceback (most recent call last):
+    Unparsable: ('line', 'bye', '')
+
+    For a text that changes a little at a time, as in an editor, its
+    document(text, rule) method returns an object whose parse() method
+    parses the text as it stands, and whose edit(start, end,
+    replacement) method changes it. The memo table carries over from
+    parse to parse, less the entries an edit could affect: those
+    whose parse got within lookahead characters (default 4096) of
+    the edit, or that start within that far after it. The entries
+    after it move along with the text, except for rules reaching a
+    special action, since that may have seen the position. So a
+    reparse mostly redoes just the work near the edit. (As with a
+    push parser, regular rules don't get matched as single regexes,
+    since the edits need to know how far each parse got.)
+
+    >>> doc = nums.document('1, 2, 3')
+    >>> doc.parse()
+    (1, 2, 3)
+    >>> doc.edit(3, 4, '20, 30')
+    >>> doc.text, doc.parse()
+    ('1, 20, 30, 3', (1, 20, 30, 3))
+    >>> doc = Parser(r"top = s (.*)   s = w hug   w = (x) y+ /z/ | (x)",
+    ...              hug=hug).document('xyy!', lookahead=0)
+    >>> doc.parse()
+    (('x',), 'yy!')
+    >>> doc.edit(3, 4, 'z')
+    >>> doc.parse()
+    (('x',), '')
+
+    Its parse_many(texts, rule) method parses each of an iterable of
+    independent texts, yielding each one's results tuple, or else its
+    Unparsable exception. It spreads the work over a pool of workers
+    processes (by default one per CPU), each with a parser of its own
+    made from the grammar and the actions it uses, which must be
+    picklable, as functions defined at the top level of a module are.
+    The texts go out in batches of chunksize (default 256), a few
+    batches per worker at a time, and the results come back in order
+    unless ordered=False, in which case each batch's come as soon as
+    it's done.
+
+    >>> list(nums.parse_many(['1, 2', 'x', '3'], workers=2))
+    [(1, 2), Unparsable('nums', '', 'x'), (3,)]
+
+    Making a parser takes a while for a big grammar, mostly to find
+    which characters can start each regex. Parser() remembers that,
+    and the rules, for the last few dozen grammars it's seen, so a
+    parser made again from the same grammar text, even with other
+    actions, comes quicker. Given a directory as the cache_dir option,
+    it also keeps it in a file there, for a quick start next time; the
+    file goes stale, and unused, when the grammar, peglet or Python
+    changes.
+
+    The options come apart from the actions, so that nearly any name
+    can be an action, as in Parser(grammar, **globals()): all but
+    `grammar` and `options`, which a module passing its globals that
+    way mustn't define. An unknown option raises ValueError, and so
+    does a function passed as the options. engine='vm' selects a
+    parsing machine in place of the default tree-walking interpreter
+    (engine='tree'). They produce the same results.
+
+    >>> Parser(r"nums = num ,\s* nums | num   num = (\d+) int", int=int,
+    ...        options=dict(engine='vm'))('42, 137, and 0 are magic numbers')
+    (42, 137)
+    >>> Parser(r"a = (x) options", options=len)
+    Traceback (most recent call last):
+    ValueError: ('Reserved name', 'options')
+    >>> Parser(r"a = (x) engine", engine=len)('x')
+    (1,)
+
+    The interpreter nests a Python call for each rule it's parsing,
+    while the machine keeps its stacks in lists, bounded only by
+    memory. So when the interpreter runs out of Python stack, it
+    starts over with the machine. (Semantic actions may then get
+    called more than once for the same input.) That's unless it was
+    a semantic action that ran out, whose RecursionError passes on.
+    A rule calling itself forever without consuming input, in a way
+    that isn't left recursion peglet can grow, raises BadGrammar.
+
+    >>> len(Parser(r"chars = (.) chars | ")('x' * 10000))
+    10000
+    >>> Parser(r"a = ()(?(1)\b) a x | x")('x')
+    Traceback (most recent call last):
+    BadGrammar: ('Recursion without progress', 'a')
+
+    Either engine matches each regular rule -- one reaching neither
+    actions nor itself -- as a single regex, under Python 3.11 and
+    up. A regex can't tell how far it got before failing, so a parse
+    that fails starts over without them, to find where the error is.
+    (Again semantic actions may get called twice.)
+
+    Another option says which rules to memoize, trading memory for
+    protection from exponential backtracking: memo='all' (the
+    default), 'none', 'auto' (just the rules the grammar might try
+    more than once at the same position, like `int` in `number = int
+    frac | int`, unless they're too simple to be worth it), or a dict
+    from rule names to booleans, overriding 'auto' for those rules.
+    Either way, a rule with no actions, no recursion and at most a
+    handful of tokens gets inlined into the rules that call it, so it
+    isn't memoized separately, unless it's True in a memo dict.
+
+    >>> grammar = (r"nums = num ,\s* nums | num   num = digits frac join float | digits int"
+    ...            r"   digits = (-?\d+)   frac = ([.]\d+)")
+    >>> for memo in ('all', 'auto', 'none', {'num': False}):
+    ...     parse = Parser(grammar, join=join, int=int, float=float, options=dict(memo=memo))
+    ...     print('%r %r, with %d memo entries' % (memo, parse('1, 2.5, -3'), parse.stats['size']))
+    'all' (1, 2.5, -3), with 5 memo entries
+    'auto' (1, 2.5, -3), with 3 memo entries
+    'none' (1, 2.5, -3), with 0 memo entries
+    {'num': False} (1, 2.5, -3), with 0 memo entries
+
+    memo_size=n caps the memo table at n entries, to parse inputs too
+    big for a full one. When it's full, memo_evict='lru' (the default)
+    drops the least recently used entry, or memo_evict='window' the
+    one farthest behind, on the theory that a parse seldom backtracks
+    far. Either way the results are the same, only maybe slower. After
+    each parse, the parsing function's `stats` attribute counts the
+    memo's hits, misses and evictions.
+
+    >>> parse = Parser(r"nums = num ,\s* nums | num   num = (\d+) int", int=int,
+    ...                options=dict(memo_size=2))
+    >>> parse('1, 2, 3, 4')
+    (1, 2, 3, 4)
+    >>> sorted(parse.stats.items())
+    [('evictions', 5), ('hits', 0), ('misses', 7), ('size', 2)]
+    >>> parse = Parser(r"nums = num ,\s* nums | num   num = (\d+) int", int=int,
+    ...                options=dict(memo_size=3, memo_evict='window'))
+    >>> parse('1, 2, 3, 4')
+    (1, 2, 3, 4)
+    >>> parse.stats['evictions'], parse.stats['size']
+    (4, 3)
+
+    lazy=True puts off compiling the grammar until a parse needs it,
+    and then compiles just the rules reachable from the rule it starts
+    from, for a quicker start with a big grammar used through only a
+    few of its rules. Lazy or not, a name that's neither a rule nor
+    an action is an error only once a parse reaches it; the parsing
+    function's check(rule) method looks for any reachable from rule
+    (by default, anywhere in the grammar) and raises BadGrammar.
+
+    >>> parse = Parser(r"a = b | c   b = (x)   c = d", options=dict(lazy=True))
+    >>> parse('x', 'b')
+    ('x',)
+    >>> parse.check('b')
+    >>> parse.check()
+    Traceback (most recent call last):
+    BadGrammar: ('Missing rule(s)', 'd')
+
+    With cache_dir, a lazy parser keeps the FIRST sets in the file as
+    each part of the grammar gets compiled.
+
+    >>> import shutil, tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> parse = Parser(r"a = b | c   b = (x)   c = (y)",
+    ...                options=dict(lazy=True, cache_dir=cache_dir))
+    >>> os.listdir(cache_dir)
+    []
+    >>> parse('y')
+    ('y',)
+    >>> len(os.listdir(cache_dir))
+    1
+    >>> shutil.rmtree(cache_dir)
+
+    profile=True makes the parsing function count and time its work,
+    adding to the dict in its `profile` attribute, from each rule's
+    name to its calls, memo hits and misses, successes, alternatives
+    tested against the next character and skipped, tries and fails of
+    its regexes and literals, and time and self time (leaving out the
+    rules it calls) in seconds. Under 'alternatives'
+    each rule has a dict from each of its alternatives, as optimized,
+    to how many times it was tried and succeeded, the tries and fails
+    of its regexes and literals, and its self time. profile_report()
+    makes a table of it. Profiling uses the interpreter; a parse too
+    deep for it goes uncounted once it falls back to the machine.
+    Without profile=True, parsing pays nothing for any of this.
+
+    >>> parse = Parser(r"word = ([a-z]+)\d | (\w+) hug", hug=hug,
+    ...                options=dict(profile=True))
+    >>> parse('hi')
+    (('hi',),)
+    >>> counts = parse.profile['word']
+    >>> counts['calls'], counts['tries'], counts['fails'], len(counts['alternatives'])
+    (1, 2, 1, 2)
     """
+    analysis = _grammar(grammar)
+    names, rules = analysis.names, analysis.rules
+    if callable(options): raise ValueError("Reserved name", 'options')
+    options = dict(options or ())
+    unknown = set(options) - set(_options)
+    if unknown: raise ValueError("Unknown option(s)", ' '.join(sorted(unknown)))
+    for name, default in _options.items(): options.setdefault(name, default)
+    cache_dir = options['cache_dir']
+    if cache_dir is not None: _load_firsts(analysis, grammar, cache_dir)
+    engine = options['engine']
+    if engine not in ('tree', 'vm'): raise ValueError("Unknown engine", engine)
+    memo = options['memo']
+    memo_size, memo_evict = options['memo_size'], options['memo_evict']
+    _memo_table(memo_size, memo_evict, 0)
+    lazy = options['lazy']
+    profile = {} if options['profile'] else None
+    if profile is not None:
+        profiling = profile, dict((id(f), name) for name, f in actions.items())
+    # Tables and machines are made per input mode as needed, with
+    # regular rules collapsed into regexes unless exact. A part says
+    # which rules they cover: all of them (None), or if lazy, just
+    # those reachable from the rule named.
+    lowered, tables, machines, inexact = {}, {}, {}, set()
+    def lower(mode, part):
+        if (mode, part) not in lowered:
+            reached = rules if part is None else _reach(rules, actions, [part])[0]
+            lowered[mode, part] = _lower(dict((name, rules[name]) for name in reached),
+                                         actions, mode)
+        return lowered[mode, part]
+    def optimize(table, mode, part, exact):
+        policy = memo
+        if part is not None and isinstance(memo, dict):
+            # Leave out the grammar's rules outside the part.
+            policy = dict((name, flag) for name, flag in memo.items()
+                          if name in table or name.split('(')[0] not in rules)
+        table = _memoize(table, policy)
+        if not exact:
+            collapsed = _collapse(table, mode)
+            if collapsed is not table: inexact.add((mode, part))
+            table = collapsed
+        return _fuse(_factor(_inline(table, policy)))
+    def table(mode, part, exact=False):
+        if (mode, part, exact) not in tables:
+            optimized = optimize(lower(mode, part), mode, part, exact)
+            tables[mode, part, exact] = optimized, _dispatch(optimized, mode,
+                                                             analysis.regex_firsts)
+            if cache_dir is not None: _store_firsts(analysis, grammar, cache_dir)
+        return tables[mode, part, exact]
+    def machine(mode, part, exact=False):
+        if (mode, part, exact) not in machines:
+            machines[mode, part, exact] = _assemble(
+                optimize(_expand_prec(lower(mode, part)), mode, part, exact), mode,
+                analysis.regex_firsts)
+            if cache_dir is not None: _store_firsts(analysis, grammar, cache_dir)
+        return machines[mode, part, exact]
+    if not lazy: (machine if engine == 'vm' else table)('str', None)
+    def run(text, rule, memo, exact, start):
+        mode, part = _input_mode(text), (rule if lazy else None)
+        if engine == 'vm' and profile is None:
+            return _run_vm(machine(mode, part, exact), rule, text, memo, start)
+        try:
+            rules, dispatch = table(mode, part, exact)
+            if profile is None:
+                return _parse(rules, rule, text, memo, dispatch, start)
+            return _parse(rules, rule, text, memo, dispatch, start, profiling)
+        except _RecursionError:
+            if _in_action(sys.exc_info()[2]): raise
+            return _run_vm(machine(mode, part, exact), rule, text, memo, start)
+    def parse_at(text, rule, start, memo=None, exact=False):
+        # The far position is exact only from an exact parse, or a failure.
+        if memo is None: memo = _memo_table(memo_size, memo_evict, len(text))
+        try:
+            try:
+                return run(text, rule, memo, exact, start)
+            except Unparsable:
+                if exact or (_input_mode(text), rule if lazy else None) not in inexact:
+                    raise
+                memo = _memo_table(memo_size, memo_evict, len(text))
+                return run(text, rule, memo, True, start)
+        finally:
+            parse.stats = memo.stats()
+    def parse(text, rule=names[0]):
+        return parse_at(text, rule, 0)[2]
+    def iterparse(text, rule=names[0], whole=False):
+        # Like rule*, stopping after a failure or an empty match.
+        pos = 0
+        while True:
+            try:
+                far, pos1, results = parse_at(text, rule, pos)
+            except Unparsable as e:
+                far = len(e.args[1])
+                break
+            yield results
+            if pos1 == pos: break
+            pos = pos1
+        if whole and pos < len(text): raise _unparsable(rule, text, max(far, pos))
+    def exact_at(text, rule, start, memo=None):
+        return parse_at(text, rule, start, memo, True)
+    def incremental(rule=names[0], lookahead=0, backlog=4096):
+        return _Incremental(exact_at,
+                            lambda length: _memo_table(memo_size, memo_evict, length),
+                            rule, lookahead, backlog)
+    def parse_stream(fileobj, rule=names[0], chunk_size=65536, lookahead=4096):
+        records = incremental(rule, lookahead, lookahead)
+        while True:
+            # Read at least as much again as is pending, so a long
+            # record gets reparsed only a logarithmic number of times.
+            chunk = fileobj.read(max(chunk_size, records.pending()))
+            if not chunk: break
+            for results in records.feed(chunk): yield results
+        for results in records.close(): yield results
+    def document(text, rule=names[0], lookahead=4096):
+        return _Document(exact_at, _memo_table(memo_size, memo_evict, len(text)),
+                         _positional(_expand_prec(lower('str', rule if lazy else None))),
+                         text, rule, lookahead)
+    def check(rule=None):
+        missing = _reach(rules, actions, names if rule is None else [rule])[1]
+        if missing: raise BadGrammar("Missing rule(s)", ' '.join(missing))
+    def parse_many(texts, rule=names[0], workers=None, chunksize=256, ordered=True):
+        # The workers get the options and just the actions the grammar uses.
+        used = _names_used(rules)
+        spec = grammar, options, dict((name, value) for name, value in actions.items()
+                                      if name in used)
+        return _parse_many(parse, spec, texts, rule, workers, chunksize, ordered)
+    def parse_async(reader, rule=names[0], chunk_size=65536, lookahead=0, backlog=4096):
+        return _AsyncRecords(incremental(rule, lookahead, backlog), reader, chunk_size)
+    parse.stats = None
+    parse.profile = profile
+    parse.iterparse = iterparse
+    parse.incremental = incremental
+    parse.parse_stream = parse_stream
+    parse.parse_async = parse_async
+    parse.document = document
+    parse.parse_many = parse_many
+    parse.check = check
+    return parse
+
+class _Incremental(object):
+    """A push parser, from a parsing function's incremental() method.
+    The input so far is self.buffer, with the record in progress
+    starting at self.start; self.memo holds that record's parse
+    results, which stay valid as the input grows, except those that
+    got too near the end to be sure."""
+    def __init__(self, parse_at, new_memo, rule, lookahead, backlog):
+        self.parse_at, self.new_memo = parse_at, new_memo
+        self.rule, self.lookahead, self.backlog = rule, lookahead, backlog
+        self.buffer, self.start, self.memo = None, 0, None
+    def pending(self):
+        "Return the length of the input not yet parsed into records."
+        return 0 if self.buffer is None else len(self.buffer) - self.start
+    def feed(self, data):
+        """Add data to the input, returning a list of the results of
+        the records it completes."""
+        if self.buffer is None:
+            self.buffer = data[:0]
+        elif self.start:
+            # Drop the text of the records done with, and the memo
+            # entries at positions that would shift.
+            self.buffer, self.start, self.memo = self.buffer[self.start:], 0, None
+        elif self.memo is not None:
+            end = len(self.buffer)
+            start = max(0, end - max(self.lookahead, self.backlog))
+            self.memo.edit(start, end, end - start + len(data))
+        self.buffer += data
+        return self.records(False)
+    def close(self):
+        """Parse the rest of the input, returning a list of the results
+        of its records, and start over with no input."""
+        try: return self.records(True)
+        finally: self.buffer, self.start, self.memo = None, 0, None
+    def records(self, eof):
+        results, buffer = [], self.buffer
+        while buffer is not None and self.start < len(buffer):
+            if self.memo is None: self.memo = self.new_memo(len(buffer))
+            try:
+                far, pos, values = self.parse_at(buffer, self.rule, self.start, self.memo)
+            except Unparsable as e:
+                far, pos = len(e.args[1]), None
+            if pos is None: wait = len(buffer) <= far + self.backlog
+            else:           wait = len(buffer) < far + self.lookahead
+            if wait and not eof: break
+            if pos is None or pos == self.start:
+                raise Unparsable(self.rule, buffer[self.start:far], buffer[far:])
+            results.append(values)
+            self.start, self.memo = pos, None
+        return results
+
+class _Document(object):
+    """A text to parse over and over as it gets edited, from a parsing
+    function's document() method. Its memo table keeps the entries
+    that edits leave valid."""
+    def __init__(self, parse_at, memo, fixed, text, rule, lookahead):
+        self.parse_at, self.memo, self.fixed = parse_at, memo, fixed
+        self.text, self.rule, self.lookahead = text, rule, lookahead
+    def parse(self):
+        "Parse the text as it stands, returning the results tuple."
+        return self.parse_at(self.text, self.rule, 0, self.memo)[2]
+    def edit(self, start, end, replacement):
+        "Replace the text from start to end with replacement."
+        text = self.text
+        if not 0 <= start <= end <= len(text):
+            raise ValueError("Bad span to edit", start, end)
+        before = max(0, start - self.lookahead)
+        after = min(len(text), end + self.lookahead)
+        self.memo.edit(before, after, start - before + len(replacement) + after - end,
+                       self.fixed)
+        self.text = text[:start] + replacement + text[end:]
+
+class _AsyncRecords(object):
+    """An async iterator over the results of the records read from an
+    asyncio.StreamReader into an _Incremental, from a parsing
+    function's parse_async() method. (It's written with callbacks,
+    not async syntax, so this module still loads in Python 2.)"""
+    def __init__(self, records, reader, chunk_size):
+        self.records, self.reader, self.chunk_size = records, reader, chunk_size
+        self.ready, self.done = collections.deque(), False
+    def __aiter__(self):
+        return self
+    def __anext__(self):
+        import asyncio
+        future = asyncio.get_event_loop().create_future()
+        self.fulfil(future)
+        return future
+    def fulfil(self, future):
+        import asyncio
+        if self.ready:
+            future.set_result(self.ready.popleft())
+        elif self.done:
+            future.set_exception(StopAsyncIteration())
+        else:
+            size = max(self.chunk_size, self.records.pending())
+            read = asyncio.ensure_future(self.reader.read(size))
+            read.add_done_callback(lambda read: self.got(read, future))
+            future.add_done_callback(lambda future: future.cancelled() and read.cancel())
+    def got(self, read, future):
+        if read.cancelled(): return
+        try:
+            data = read.result()
+            if data: self.ready.extend(self.records.feed(data))
+            else:    self.ready.extend(self.records.close())
+            self.done = not data
+        except Exception as e:
+            if not future.done(): future.set_exception(e)
+            return
+        if not future.done(): self.fulfil(future)
+
+if (3, 7) <= sys.version_info:
+    __test__ = {'parse_async': r"""
+    parse_async() reads from a StreamReader as the parse needs more.
+    Cancelling a wait for the next record cancels its read, and the
+    iterator carries on from there.
+
+    >>> import asyncio
+    >>> lines = Parser(r"line = ([^\n]*) \n")
+    >>> async def read_all():
+    ...     reader = asyncio.StreamReader()
+    ...     reader.feed_data(b'hello\nworld\n')
+    ...     reader.feed_eof()
+    ...     return [line async for line, in lines.parse_async(reader, chunk_size=4)]
+    >>> asyncio.run(read_all())
+    [b'hello', b'world']
+    >>> async def cancel():
+    ...     reader = asyncio.StreamReader()
+    ...     records = lines.parse_async(reader)
+    ...     reader.feed_data(b'hi\nbye')
+    ...     print(await records.__anext__())
+    ...     try: await asyncio.wait_for(records.__anext__(), 0.01)
+    ...     except asyncio.TimeoutError: print('timed out')
+    ...     reader.feed_data(b'\n')
+    ...     reader.feed_eof()
+    ...     return [line async for line, in records]
+    >>> asyncio.run(cancel())
+    (b'hi',)
+    timed out
+    [b'bye']
+    """}
+
+# parse_many() makes each worker process its own parser, from the
+# grammar, options and actions (pickled by name), and sends it the
+# texts in batches, keeping a few batches per worker in flight.
+
+_worker_parser = None
+
+def _start_worker(grammar, options, actions):
+    global _worker_parser
+    _worker_parser = Parser(grammar, options, **actions)
+
+def _parse_batch(batch):
+    rule, texts = batch
+    return [_parse_or_fail(_worker_parser, text, rule) for text in texts]
+
+def _parse_or_fail(parse, text, rule):
+    try: return parse(text, rule)
+    except Unparsable as e: return e
+
+def _parse_many(parse, spec, texts, rule, workers, chunksize, ordered):
+    import multiprocessing
+    if workers is None: workers = multiprocessing.cpu_count()
+    texts = iter(texts)
+    if workers <= 1:
+        for text in texts: yield _parse_or_fail(parse, text, rule)
+        return
+    batches = iter(lambda: list(itertools.islice(texts, chunksize)), [])
+    pool = multiprocessing.Pool(workers, _start_worker, spec)
+    try:
+        pending = collections.deque()
+        for batch in itertools.chain(batches, [None]):
+            if batch is not None:
+                pending.append(pool.apply_async(_parse_batch, ((rule, batch),)))
+            while pending and (batch is None or 2 * workers <= len(pending)):
+                done = pending[0]
+                if not ordered:
+                    done = next((each for each in pending if each.ready()), done)
+                pending.remove(done)
+                for result in done.get(): yield result
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+# Parser()'s options, and their defaults.
+_options = dict(engine='tree', memo='all', memo_size=None, memo_evict='lru',
+                lazy=False, profile=False, cache_dir=None)
+
+def _names_used(rules):
+    "Return the set of tokens in rules, less any '!' prefixes."
+    names = set()
+    def walk(alternatives):
+        for alternative in alternatives:
+            for token in alternative:
+                if isinstance(token, tuple): walk(token[0])
+                else: names.add(token.lstrip('!'))
+    for alternatives in rules.values(): walk(alternatives)
+    return names
+
+def _reach(rules, actions, starts):
+    """Return the set of names of the rules reachable from starts,
+    and the list of the names they refer to that are neither rules
+    nor actions, for which _lower() makes 'error' nodes."""
+    reached, missing, agenda = set(), [], collections.deque(starts)
+    def visit(token):
+        if isinstance(token, tuple):
+            for alternative in token[0]:
+                for each in alternative: visit(each)
+            return
+        while re.match(r'!.', token): token = token[1:]
+        if token in rules:
+            agenda.append(token)
+        elif token[:-1] in rules and token[-1] in '?*+':
+            agenda.append(token[:-1])
+        elif token in actions:
+            f = actions[token]
+            if isinstance(f, _Infix):
+                visit(f.operand)
+                for _, operator, _ in f.levels:
+                    for each in operator.split(): visit(each)
+        elif re.match(_identifier+'$', token) and token not in missing:
+            missing.append(token)
+    while agenda:
+        name = agenda.popleft()
+        if name not in reached:
+            reached.add(name)
+            visit((rules[name], ''))
+    return reached, missing
+
+def _split(grammar):
+    """Return the list of rule names in grammar, in order, and a dict
+    mapping each name to its list of alternatives, each a list of
+    tokens, where a parenthesized group is a tuple of its own list of
+    alternatives and its postfix operator, if any."""
     parts = re.split(' ('+_identifier+') += ',
                      ' '+re.sub(r'\s', ' ', grammar))
     if len(parts) == 1 or parts[0].strip():
         raise BadGrammar("Missing left hand side", parts[0])
     if len(set(parts[1::2])) != len(parts[1::2]):
         raise BadGrammar("Multiply-defined rule(s)", grammar)
-    rules = dict((lhs, [alt.split() for alt in (' '+rhs+' ').split(' | ')])
+    rules = dict((lhs, _group(lhs, rhs.split()))
                  for lhs, rhs in zip(parts[1::2], parts[2::2]))
-    return lambda text, rule=parts[1]: _parse(rules, actions, rule, text)
+    return parts[1::2], rules
+
+def _group(name, tokens):
+    "Parse the right-hand side of rule name into alternatives and groups."
+    groups = [[[]]]
+    for token in tokens:
+        if token == '(':
+            groups.append([[]])
+        elif token == '|':
+            groups[-1].append([])
+        elif re.match(r'\)[*+?]?$', token):
+            if len(groups) == 1: raise BadGrammar("Unmatched ')'", name)
+            alternatives = groups.pop()
+            groups[-1][-1].append((alternatives, token[1:]))
+        else:
+            groups[-1][-1].append(token)
+    if len(groups) != 1: raise BadGrammar("Unmatched '('", name)
+    return groups[0]
+
+# Parser() keeps what it learns from a grammar's text alone -- its rules,
+# and the FIRST sets of their regexes, much the slowest part to find --
+# for the last _grammar_limit grammars it's seen, so making another
+# parser from the same grammar, even with other actions, is quicker.
+# With cache_dir, it also keeps the FIRST sets in a file there, for the
+# next process, named by a hash of the grammar and of peglet's and
+# Python's versions (since the sets come from the re module's parser).
+
+_grammars = collections.OrderedDict()
+_grammar_limit = 64
+
+class _Grammar(object):
+    """A grammar's rule names in order and rules, from _split(), and
+    a dict of its regexes' FIRST sets, for _first()."""
+    def __init__(self, grammar):
+        self.names, self.rules = _split(grammar)
+        self.regex_firsts = {}
+        self.stored = {}   # cache_dir -> how many FIRST sets its file has
+
+def _grammar(grammar):
+    "Return the _Grammar for this grammar, from _grammars if it's there."
+    analysis = _grammars.pop(grammar, None) or _Grammar(grammar)
+    _grammars[grammar] = analysis   # now the most recently used
+    while _grammar_limit < len(_grammars): _grammars.popitem(last=False)
+    return analysis
+
+def _cache_file(grammar, cache_dir):
+    key = repr((__version__, sys.version, grammar)).encode('utf-8')
+    return os.path.join(cache_dir, 'peglet-%s.txt' % hashlib.sha1(key).hexdigest())
+
+def _load_firsts(analysis, grammar, cache_dir):
+    """Add the FIRST sets in grammar's file under cache_dir to
+    analysis's, unless already done. A missing or unreadable file
+    counts as empty."""
+    if cache_dir in analysis.stored: return
+    try:
+        with open(_cache_file(grammar, cache_dir), 'rb') as f:
+            stored_grammar, entries = ast.literal_eval(f.read().decode('utf-8'))
+        stored = {}
+        if stored_grammar == grammar:
+            for pattern, flags, codes, empty in entries:
+                stored[pattern, flags] = None if codes is None else set(codes), empty
+    except Exception: # a cache is no reason to fail
+        stored = {}
+    analysis.regex_firsts.update(stored)
+    analysis.stored[cache_dir] = len(stored)
+
+try: _replace = os.replace
+except AttributeError: _replace = os.rename # Python 2, which can't replace on Windows
+
+def _store_firsts(analysis, grammar, cache_dir):
+    """Write analysis's FIRST sets to grammar's file under cache_dir,
+    if it lacks any. The file holds Python literals, to read back with
+    ast.literal_eval(), and gets replaced whole, so a concurrent reader
+    sees the old one or the new.
+
+    >>> import shutil, tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> analysis = _Grammar(r"a = (x)")
+    >>> analysis.regex_firsts['(x)', 0] = set([120]), False
+    >>> _store_firsts(analysis, r"a = (x)", cache_dir)
+    >>> loaded = _Grammar(r"a = (x)")
+    >>> _load_firsts(loaded, r"a = (x)", cache_dir)
+    >>> loaded.regex_firsts == analysis.regex_firsts
+    True
+    >>> shutil.rmtree(cache_dir)
+    """
+    if len(analysis.regex_firsts) <= analysis.stored.get(cache_dir, 0): return
+    entries = [(pattern, flags, None if codes is None else sorted(codes), empty)
+               for (pattern, flags), (codes, empty) in analysis.regex_firsts.items()]
+    filename = _cache_file(grammar, cache_dir)
+    temp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            f.write(repr((grammar, entries)).encode('utf-8'))
+        _replace(temp, filename)
+    except (IOError, OSError):
+        try: os.remove(temp)
+        except OSError: pass
+    analysis.stored[cache_dir] = len(analysis.regex_firsts)
 
 class BadGrammar(Exception):
     "A peglet grammar was ill-formed."
@@ -153,46 +909,1518 @@ class BadGrammar(Exception):
 class Unparsable(Exception):
     "An attempted parse failed because the input did not match the grammar."
 
-def _parse(rules, actions, rule, text):
-    # Each function takes a position pos (and maybe a values tuple
+# A literal token: a regex that matches only one particular string.
+_literal = re.compile(r'(?:[^\\.^$*+?{}\[\]|()]|\\\W|[{}](?![\d,]))*$')
+
+_strings = (type(u''), type(''))
+
+try: _unichr = unichr
+except NameError: _unichr = chr # Python 3
+
+try: _ascii = ascii
+except NameError: _ascii = repr # Python 2, whose repr() is ASCII already
+
+def _input_mode(text):
+    """Return 'str' for a string, 'bytes' for a bytes-like object
+    with a startswith method, or else 'buffer'."""
+    if isinstance(text, _strings): return 'str'
+    return 'bytes' if hasattr(text, 'startswith') else 'buffer'
+
+def _lower(rules, actions, mode):
+    """Compile each token of each rule into a node (kind, x), so that
+    parsing needn't re-classify tokens or look up regexes each time
+    round. The kinds are '!' (negation of the node x), 'rule' (x is
+    the name; see also _memoize()), 'opt', 'star' and 'plus' (x is the
+    name of a rule to call unmemoized at most once, as many times as
+    it will match, or at least once), 'action' and 'special' (x is
+    the function), 'prec' (x is an infix() table's operand node and
+    levels, with their operators as lists of nodes), 'literal' (x is
+    the string to match), 'regex' (x is a compiled pattern), and
+    'error' (x is the args for a
+    BadGrammar to raise if it's reached, since an unused rule may
+    refer to some undefined name). A group becomes a rule of its own,
+    named after the rule it's in, like 'name(1)', and called
+    unmemoized (kind 'call'). The mode, from _input_mode(), says what
+    kind of input to match."""
+    table, groups = {}, {}
+    repeat = {'': 'call', '?': 'opt', '*': 'star', '+': 'plus'}
+    def lower_rule(name, rule, alternatives):
+        table[name] = [[lower(rule, token) for token in alternative]
+                       for alternative in alternatives]
+    def lower(rule, token):
+        if isinstance(token, tuple):
+            alternatives, op = token
+            count = groups.setdefault(rule, itertools.count(1))
+            name = '%s(%d)' % (rule, next(count))
+            lower_rule(name, rule, alternatives)
+            return repeat[op], name
+        elif re.match(r'!.', token):
+            return '!', lower(rule, token[1:])
+        elif token in rules:
+            return 'rule', token
+        elif token[:-1] in rules and token[-1] in '?*+':
+            return repeat[token[-1]], token[:-1]
+        elif token in actions:
+            f = actions[token]
+            if isinstance(f, _Infix):
+                return 'prec', (lower(rule, f.operand),
+                                tuple((right, [lower(rule, t) for t in operator.split()],
+                                       action)
+                                      for right, operator, action in f.levels))
+            return 'special' if hasattr(f, 'peglet_action') else 'action', f
+        elif re.match(_identifier+'$', token):
+            return 'error', ("Missing rule", token)
+        else:
+            if re.match(r'/.+/$', token): token = token[1:-1]
+            literal = _literal.match(token) and re.sub(r'\\(.)', r'\1', token)
+            if mode != 'str':
+                token = token.encode('utf-8')
+                literal = literal and literal.encode('utf-8')
+            if literal and mode != 'buffer':
+                return 'literal', literal
+            try: return 'regex', re.compile(token)
+            except re.error: return 'error', ("Bad regex", token)
+    for name, alternatives in rules.items():
+        lower_rule(name, name, alternatives)
+    return table
+
+# Memo tables map a rule name and position to a parse result, with
+# get() returning None for a missing entry. Each counts its hits,
+# misses and evictions.
+
+def _memo_table(size, evict, length):
+    """Return an empty memo table for parsing an input of this length,
+    holding at most size entries."""
+    if size is None: return _Memo(length)
+    if evict == 'lru': return _LRUMemo(size)
+    if evict == 'window': return _WindowMemo(size)
+    raise ValueError("Unknown memo eviction policy", evict)
+
+class _Memo(object):
+    """An unbounded memo table. Each rule's results start out in a
+    dict from position to result, or to just the far position for a
+    failure. Once a rule has results for enough of the positions,
+    they move to arrays indexed by position: of the end positions
+    (with -1 for failure and -2 for no entry), the far positions, and
+    the values."""
+    def __init__(self, length):
+        self.length = length + 1
+        self.sparse, self.dense = {}, {}
+        self.hits = self.misses = self.evictions = 0
+    def get(self, name, pos):
+        table = self.sparse.get(name)
+        if table is not None:
+            result = table.get(pos)
+            if result is not None:
+                self.hits += 1
+                return result if result.__class__ is tuple else (result, None, ())
+        elif name in self.dense:
+            ends, fars, vals = self.dense[name]
+            end = ends[pos]
+            if end != -2:
+                self.hits += 1
+                if end == -1: return fars[pos], None, ()
+                return fars[pos], end, vals[pos]
+        self.misses += 1
+        return None
+    def put(self, name, pos, result):
+        far, end, vals = result
+        if name in self.dense:
+            ends, fars, values = self.dense[name]
+            ends[pos], fars[pos] = -1 if end is None else end, far
+            if end is not None: values[pos] = vals
+            return
+        table = self.sparse.setdefault(name, {})
+        table[pos] = far if end is None else result
+        if self.length < 8 * len(table):
+            ends = array.array('l', [-2]) * self.length
+            fars = array.array('l', [0]) * self.length
+            values = [None] * self.length
+            for pos, result in table.items():
+                if result.__class__ is tuple:
+                    fars[pos], ends[pos], values[pos] = result
+                else:
+                    fars[pos], ends[pos] = result, -1
+            del self.sparse[name]
+            self.dense[name] = ends, fars, values
+    def edit(self, start, end, size, fixed=()):
+        """Adjust for the input from start to end getting replaced by
+        size characters: drop the results from before end that got as
+        far as start, and move those from end on, except for the rules
+        in fixed, whose results can't move. The arrays' entries would
+        all have to move, so the results go back to dicts for good."""
+        delta = size - (end - start)
+        self.length = sys.maxsize
+        for name, (ends, fars, values) in self.dense.items():
+            self.sparse[name] = dict(
+                (pos, fars[pos] if ends[pos] == -1 else (fars[pos], ends[pos], values[pos]))
+                for pos in range(len(ends)) if ends[pos] != -2)
+        self.dense = {}
+        for name, table in self.sparse.items():
+            kept = dict((pos, result) for pos, result in table.items()
+                        if pos < end and (result[0] if result.__class__ is tuple
+                                          else result) < start)
+            if name not in fixed:
+                kept.update((pos + delta, _shift(result, delta) if result.__class__ is tuple
+                                          else result + delta)
+                            for pos, result in table.items() if end <= pos)
+            self.sparse[name] = kept
+    def stats(self):
+        size = sum(map(len, self.sparse.values()))
+        size += sum(len(ends) - ends.count(-2)
+                    for ends, _, _ in self.dense.values())
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=size)
+
+class _LRUMemo(_Memo):
+    def __init__(self, size):
+        self.size, self.entries = size, collections.OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+    def get(self, name, pos):
+        result = self.entries.pop((name, pos), None)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries[name, pos] = result
+        return result
+    def put(self, name, pos, result):
+        self.entries[name, pos] = result
+        if self.size < len(self.entries):
+            self.entries.popitem(last=False)
+            self.evictions += 1
+    def edit(self, start, end, size, fixed=()):
+        delta = size - (end - start)
+        entries = self.entries.__class__()
+        for (name, pos), result in self.entries.items():
+            if end <= pos:
+                if name not in fixed: entries[name, pos + delta] = _shift(result, delta)
+            elif result[0] < start: entries[name, pos] = result
+        self.entries = entries
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self.entries))
+
+class _WindowMemo(_LRUMemo):
+    def __init__(self, size):
+        _LRUMemo.__init__(self, size)
+        self.entries, self.heap = {}, []   # heap of (pos, name) of entries
+    def get(self, name, pos):
+        result = self.entries.get((name, pos))
+        if result is None: self.misses += 1
+        else: self.hits += 1
+        return result
+    def put(self, name, pos, result):
+        if (name, pos) not in self.entries:
+            heapq.heappush(self.heap, (pos, name))
+        self.entries[name, pos] = result
+        if self.size < len(self.entries):
+            pos, name = heapq.heappop(self.heap)
+            del self.entries[name, pos]
+            self.evictions += 1
+    def edit(self, start, end, size, fixed=()):
+        _LRUMemo.edit(self, start, end, size, fixed)
+        self.heap = [(start, name) for name, start in self.entries]
+        heapq.heapify(self.heap)
+
+def _shift(result, delta):
+    "Return a memo result (far, end, vals) moved delta places."
+    far, end, vals = result
+    return far + delta, None if end is None else end + delta, vals
+
+# Grammar analysis
+
+def _map_nodes(table, f):
+    """Return a copy of table with f applied to each node, including
+    those inside negations, operator tables and choices."""
+    def walk(node):
+        if node[0] == '!': node = '!', walk(node[1])
+        if node[0] == 'choice':
+            node = 'choice', [[walk(each) for each in alternative]
+                              for alternative in node[1]]
+        if node[0] == 'prec':
+            operand, levels = node[1]
+            node = 'prec', (walk(operand),
+                            tuple((right, [walk(each) for each in operator], action)
+                                  for right, operator, action in levels))
+        return f(node)
+    return dict((name, [[walk(node) for node in alternative]
+                        for alternative in alternatives])
+                for name, alternatives in table.items())
+
+def _nullable(table):
+    """Return the set of names of rules that might succeed without
+    consuming any input."""
+    nullable = set()
+    while True:
+        more = set(name for name, alternatives in table.items()
+                   if any(all(_can_be_empty(node, nullable)
+                              for node in alternative)
+                          for alternative in alternatives))
+        if more == nullable: return nullable
+        nullable = more
+
+def _can_be_empty(node, nullable):
+    "Might node succeed without consuming input, given the nullable rules?"
+    kind, x = node
+    if kind == 'literal': return False
+    if kind in ('regex', 'regular'): return _regex_can_be_empty(x)
+    if kind == 'fused': return x[2]
+    if kind in ('rule', 'call', 'left', 'plus'): return x in nullable
+    if kind == 'prec': return _can_be_empty(x[0], nullable)
+    if kind == 'choice':
+        return any(all(_can_be_empty(each, nullable) for each in alternative)
+                   for alternative in x)
+    return True
+
+_empty_regexes = {}
+
+def _regex_can_be_empty(regex):
+    r"""Might regex match without consuming input somewhere? Matching
+    it against the empty string can't tell, for a zero-width token
+    like \b or a lookahead, so ask sre_parse, as for a FIRST set.
+
+    >>> [_regex_can_be_empty(re.compile(p)) for p in (r'\b', r'(?=\d)', r'\d*', r'\d')]
+    [True, True, True, False]
+    """
+    key = regex.pattern, regex.flags
+    if key not in _empty_regexes:
+        codes, empty = _regex_first(regex)
+        if codes is None: empty = regex.match(regex.pattern[:0]) is not None
+        _empty_regexes[key] = empty
+    return _empty_regexes[key]
+
+def _called(node):
+    """Return the name of the rule node calls first, if any, even if
+    negated."""
+    while node[0] in ('!', 'prec'):
+        node = node[1] if node[0] == '!' else node[1][0]
+    if node[0] in ('rule', 'call', 'left', 'opt', 'star', 'plus'): return node[1]
+
+def _leading(table, nullable):
+    """Return a dict mapping each rule name to the set of rules it
+    may call, directly or indirectly, at its own starting position."""
+    leading = {}
+    for name, alternatives in table.items():
+        leading[name] = set()
+        for alternative in alternatives:
+            for node in alternative:
+                if _called(node): leading[name].add(_called(node))
+                if not _can_be_empty(node, nullable): break
+    while True:
+        more = dict((name, callees.union(*[leading[c] for c in callees]))
+                    for name, callees in leading.items())
+        if more == leading: return leading
+        leading = more
+
+def _reachable(table):
+    """Return a dict mapping each rule name to the set of rules it may
+    call, directly or indirectly."""
+    calls = dict((name, _referenced({name: alternatives}, 'rule', 'call', 'left',
+                                    'opt', 'star', 'plus'))
+                 for name, alternatives in table.items())
+    while True:
+        more = dict((name, callees.union(*[calls[c] for c in callees]))
+                    for name, callees in calls.items())
+        if more == calls: return calls
+        calls = more
+
+def _positional(table):
+    """Return the set of names of rules that may reach a special
+    action, whose results may depend on the absolute position."""
+    reach = _reachable(table)
+    direct = set(name for name, alternatives in table.items()
+                 if _referenced({name: alternatives}, 'special'))
+    return set(name for name in table if direct & (reach[name] | set([name])))
+
+def _left_recursive(table):
+    r"""Return the set of rules that may call themselves at their own
+    starting position.
+
+    >>> sorted(_left_recursive(_lower(_split(r"a = a x | b   b = (b)")[1], {}, 'str')))
+    ['a']
+
+    A zero-width token doesn't hide left recursion behind it:
+
+    >>> sorted(_left_recursive(_lower(_split(r"a = \b a x | (?=b) b   b = (b)")[1], {}, 'str')))
+    ['a']
+    """
+    leading = _leading(table, _nullable(table))
+    return set(name for name in table
+               if not re.search(r'\(\d+\)$', name) and name in leading[name])
+
+# FIRST sets: which characters a match could start with. A set holds
+# character codes, with _high standing for every code from it up, or is
+# None for "any character or even none". Under Python 2 a str input may
+# be bytes or unicode, whose characters agree only on ASCII, so there
+# every code past ASCII counts as high.
+
+_high = 256 if sys.version_info[0] >= 3 else 128
+
+def _first(table, regex_firsts=None):
+    r"""Return a dict mapping each rule name to a list of the FIRST
+    sets of its alternatives. An alternative that can match without
+    consuming input, or that reaches a special action or an error, gets
+    None: we can't tell from the next character that it will fail.
+    regex_firsts is a dict keeping each regex's FIRST set, by pattern
+    and flags, from call to call.
+
+    >>> table = _lower(_split(r"a = b | -(\d) | c   b = x\w   c = !y .")[1], {}, 'str')
+    >>> [sorted(codes) if codes else codes for codes in _first(table)['a']]
+    [[120], [45], None]
+    """
+    risky = _risky(table)
+    firsts = dict((name, (set(), False)) for name in table)
+    if regex_firsts is None: regex_firsts = {}
+    def regex_first(regex):
+        key = regex.pattern, regex.flags
+        if key not in regex_firsts: regex_firsts[key] = _regex_first(regex)
+        return regex_firsts[key]
+    def first(nodes):
+        codes = set()
+        for node in nodes:
+            kind, x = node
+            if kind in ('rule', 'call', 'left', 'opt', 'star', 'plus'):
+                more, empty = firsts[x]
+                empty = empty or kind in ('opt', 'star')
+            elif kind == 'prec':
+                more, empty = first([x[0]])
+            elif kind == 'choice':
+                more, empty = _union([first(alternative) for alternative in x])
+            elif kind == 'literal':
+                more, empty = set([min(ord(x[:1]), _high)]), False
+            elif kind in ('regex', 'regular'):
+                more, empty = regex_first(x)
+            elif kind == 'fused':
+                more, empty = regex_first(x[0])
+            elif kind == 'action' or (kind == '!' and not _is_risky(node, risky)):
+                more, empty = set(), True
+            else:
+                more = None
+            if more is None: return None, False
+            codes |= more
+            if not empty: return codes, False
+        return codes, True
+    while True:
+        more = dict((name, _union([first(alternative) for alternative in alternatives]))
+                    for name, alternatives in table.items())
+        if more == firsts: break
+        firsts = more
+    return dict((name, [None if empty else codes
+                        for codes, empty in map(first, alternatives)])
+                for name, alternatives in table.items())
+
+def _union(firsts):
+    "Combine (codes, empty) pairs for alternatives into one for the choice."
+    if any(codes is None for codes, _ in firsts): return None, False
+    return (set().union(*[codes for codes, _ in firsts]),
+            any(empty for _, empty in firsts))
+
+def _risky(table):
+    """Return the set of rules that may reach a special action or an
+    error, whose effects we mustn't skip even inside a negation."""
+    risky = set()
+    while True:
+        more = set(name for name, alternatives in table.items()
+                   if any(_is_risky(node, risky)
+                          for alternative in alternatives for node in alternative))
+        if more == risky: return risky
+        risky = more
+
+def _is_risky(node, risky):
+    kind, x = node
+    if kind in ('special', 'error'): return True
+    if kind == '!': return _is_risky(x, risky)
+    if kind == 'choice':
+        return any(_is_risky(each, risky) for alternative in x for each in alternative)
+    if kind == 'prec':
+        return (_is_risky(x[0], risky)
+                or any(_is_risky(each, risky)
+                       for _, operator, _ in x[1] for each in operator))
+    return kind in ('rule', 'call', 'left', 'opt', 'star', 'plus') and x in risky
+
+def _regex_first(regex):
+    """Return the FIRST set of a compiled regex, and whether it might
+    match without consuming input.
+
+    >>> codes = _regex_first(re.compile(u'(?i)k'))[0]
+    >>> sorted(codes - set([_high])), _high in codes
+    ([75, 107], True)
+    >>> _regex_first(re.compile(u'(?i)\\u017f'))
+    (None, False)
+
+    Bytes patterns ignore case too, past ASCII included:
+
+    >>> parse = Parser(r"a = (?i)([^k]) | (?i)(k)")
+    >>> parse(b'x') == (b'x',), parse(b'\\xdf') == (b'\\xdf',), parse(b'K') == (b'K',)
+    (True, True, True)
+    """
+    if regex.flags & re.LOCALE: return None, False
+    try: parsed = _sre_parse.parse(regex.pattern, regex.flags)
+    except Exception: return None, False # sre_parse is internal, so be wary
+    codes, empty = _sre_first(parsed, regex)
+    if codes is not None and regex.flags & re.IGNORECASE:
+        codes = _fold_cases(codes, regex)
+    return codes, empty
+
+def _sre_first(items, regex):
+    "Like _regex_first(), for a sequence of sre_parse items."
+    codes = set()
+    for op, av in items:
+        if op == _sre_parse.LITERAL:
+            more, empty = set([min(av, _high)]), False
+        elif op == _sre_parse.ANY:
+            more, empty = set(range(_high + 1)), False
+        elif op == _sre_parse.NOT_LITERAL:
+            more, empty = set(range(_high + 1)) - set([av]), False
+        elif op == _sre_parse.IN:
+            more, empty = _sre_class_first(av, regex), False
+        elif op == _sre_parse.BRANCH:
+            more, empty = _union([_sre_first(each, regex) for each in av[1]])
+        elif op == _sre_parse.SUBPATTERN:
+            if len(av) == 4 and av[1] & (re.IGNORECASE | re.LOCALE):
+                return None, False
+            more, empty = _sre_first(av[-1], regex)
+        elif op in _sre_repeats:
+            more, empty = _sre_first(av[2], regex)
+            empty = empty or av[0] == 0
+        elif op == getattr(_sre_parse, 'ATOMIC_GROUP', None):
+            more, empty = _sre_first(av, regex)
+        elif op in (_sre_parse.AT, _sre_parse.ASSERT, _sre_parse.ASSERT_NOT):
+            more, empty = set(), True
+        else:
+            more = None
+        if more is None: return None, False
+        codes |= more
+        if not empty: return codes, False
+    return codes, True
+
+_sre_repeats = [getattr(_sre_parse, name) for name in
+                ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                if hasattr(_sre_parse, name)]
+
+def _sre_class_first(items, regex):
+    "Return the codes a character class [...] can match."
+    codes, negate = set(), False
+    for op, av in items:
+        if op == _sre_parse.NEGATE:
+            negate = True
+        elif op == _sre_parse.LITERAL:
+            codes.add(min(av, _high))
+        elif op == _sre_parse.RANGE:
+            codes.update(range(av[0], min(av[1], _high - 1) + 1))
+            if _high <= av[1]: codes.add(_high)
+        elif op == _sre_parse.CATEGORY:
+            codes |= _category_codes(av, regex)
+        else:
+            return set(range(_high + 1))
+    if negate: codes = set(range(_high)) - codes | set([_high])
+    return codes
+
+_categories = dict((getattr(_sre_parse, 'CATEGORY_' + name), escape)
+                   for name, escape in [('DIGIT', r'\d'), ('NOT_DIGIT', r'\D'),
+                                        ('SPACE', r'\s'), ('NOT_SPACE', r'\S'),
+                                        ('WORD', r'\w'), ('NOT_WORD', r'\W')])
+
+def _category_codes(category, regex):
+    "Return the codes a class like \\d can match, under regex's flags."
+    if category not in _categories: return set(range(_high + 1))
+    escape = _categories[category]
+    if isinstance(regex.pattern, _strings):
+        chars = [_unichr(code) for code in range(_high)]
+    else:
+        escape = escape.encode('ascii')
+        chars = [bytes(bytearray([code])) for code in range(_high)]
+    pattern = re.compile(escape, regex.flags & ~re.IGNORECASE)
+    codes = set(code for code in range(_high) if pattern.match(chars[code]))
+    if isinstance(regex.pattern, _strings): codes.add(_high)
+    return codes
+
+def _fold_cases(codes, regex):
+    """Add the other cases of the letters among codes, for re.IGNORECASE,
+    or return None if we can't tell them: past ASCII, Unicode folds some
+    letters into others, like the long s into s and the Kelvin sign into k.
+    A bytes pattern folds just the ASCII letters."""
+    text = isinstance(regex.pattern, _strings)
+    if text and any(128 <= code for code in codes):
+        return None
+    more = set([_high]) if text else set()
+    for code in codes:
+        if code < 128:
+            char = chr(code)
+            more.update(ord(c) for c in (char.lower(), char.upper()))
+    return codes | more
+
+def _dispatch(table, mode, regex_firsts=None):
+    """Return a dict mapping the names of rules with alternatives we can
+    skip, by looking at the next character, to a pair: a dict from
+    that character (as indexing the input gives it, or None at the end)
+    to a triple (the alternatives to try, how many of the rule's
+    alternatives got tested, how many skipped), and the triple for a
+    character not in the dict."""
+    dispatch = {}
+    for name, firsts in _first(table, regex_firsts).items():
+        if all(codes is None for codes in firsts): continue
+        alternatives = list(zip(table[name], firsts))
+        tested = sum(codes is not None for codes in firsts)
+        def choose(code):
+            chosen = tuple(alternative for alternative, codes in alternatives
+                           if codes is None or code in codes)
+            return chosen, tested, len(firsts) - len(chosen)
+        by_char = {}
+        for code in set().union(*[codes for codes in firsts if codes]):
+            if code == _high: continue
+            for key in _keys(code, mode): by_char[key] = choose(code)
+        dispatch[name] = by_char, choose(_high)
+    return dispatch
+
+def _keys(code, mode):
+    """Return the ways indexing an input of this mode may give the
+    character with this code (ints from bytes under Python 3, strings
+    of length 1 otherwise)."""
+    if mode == 'str': return set([_unichr(code)])
+    return set([code, chr(code)])
+
+# Fusing: a run of literal and regex nodes in an alternative can match
+# as one regex, with each regex in an atomic group, since a token never
+# backtracks into the one before it. Each piece after the first is
+# optional, so that a partial match ends where the run would have
+# failed, at the far position; an empty group at the end marks a full
+# match. Atomic groups need Python 3.11, so before that we don't fuse.
+
+_atomic_groups = sys.version_info >= (3, 11)
+
+def _fuse(table):
+    r"""Return table with each run of fusable literal and regex nodes
+    replaced by a 'fused' node, whose x is a triple: the fused pattern,
+    the number of groups in it before the marker group, and whether
+    the run could match the empty string.
+
+    >>> table = _fuse(_lower(_split(r"a = \[ (\d+)* \] x   x = y")[1], {}, 'str'))
+    >>> [kind for kind, x in table['a'][0]] == (['fused', 'rule'] if _atomic_groups else
+    ...                                          ['literal', 'regex', 'literal', 'rule'])
+    True
+    """
+    if not _atomic_groups: return table
+    def fuse(alternative):
+        result, run = [], []
+        for node in alternative + [None]:
+            if node is not None and _fusable(node):
+                run.append(node)
+                continue
+            if node is not None and node[0] == 'choice':
+                node = 'choice', [fuse(each) for each in node[1]]
+            if len(run) < 2: result.extend(run)
+            else: result.append(('fused', _fused(run)))
+            run = []
+            if node is not None: result.append(node)
+        return result
+    return dict((name, [fuse(alternative) for alternative in alternatives])
+                for name, alternatives in table.items())
+
+def _fusable(node):
+    kind, x = node
+    if kind == 'literal': return True
+    # No named groups, backreferences or global flags, which would
+    # change meaning in company.
+    return (kind == 'regex' and not x.groupindex
+            and x.flags == re.compile(x.pattern[:0]).flags
+            and not re.search(r'\\[1-9]|\(\?P=|\(\?\(',
+                              _latin1(x.pattern)))
+
+def _fused(run):
+    pieces = [re.escape(_latin1(x)) if kind == 'literal'
+              else '(?>%s)' % _latin1(x.pattern)
+              for kind, x in run]
+    pattern = '()'
+    for piece in reversed(pieces[1:]):
+        pattern = '(?:%s%s)?' % (piece, pattern)
+    pattern = pieces[0] + pattern
+    if not isinstance(run[0][1] if run[0][0] == 'literal' else run[0][1].pattern,
+                      type(u'')):
+        pattern = pattern.encode('latin-1')
+    groups = sum(x.groups for kind, x in run if kind == 'regex')
+    return (re.compile(pattern), groups,
+            all(_can_be_empty(node, ()) for node in run))
+
+def _latin1(s):
+    "Return s as a string, decoding it from bytes 1:1 if need be."
+    return s if isinstance(s, type(u'')) else s.decode('latin-1')
+
+# Collapsing: a rule that reaches no actions and no recursion is
+# regular, and a regex can match it the way the rule would, with atomic
+# groups to make its choices and repetitions commit as PEG ones do. The
+# regex matches the tokens' groups in order; where some needn't take
+# part (under a choice, `?` or `!`), it's a 'regular' node, dropping
+# the None values of the groups that didn't -- which is right only if
+# each token's own groups always take part.
+#
+# A regex doesn't tell how far it got before failing, so a failed
+# parse with collapsed rules gets rerun without, to find the error.
+
+_collapse_limit = 4096   # the longest regex to collapse a rule into
+
+def _collapse(table, mode):
+    r"""Return table with references to regular rules replaced by regex
+    or 'regular' nodes (the same as regex but for dropping the values
+    of groups not taking part), or table itself if no rule is regular.
+
+    >>> table = _lower(_split(r"a = b c | (x)   b = (\d+) (y|z)?   c = (w) | !\d")[1], {}, 'str')
+    >>> table = _collapse(table, 'str')
+    >>> [node[0] for node in table['a'][0]] == (['regex', 'regular'] if _atomic_groups else
+    ...                                         ['rule', 'rule'])
+    True
+    """
+    if not _atomic_groups: return table
+    patterns = {}   # rule name -> (regex text, groups, sparse, dense) or None
+    def rule_pattern(name):
+        if name not in patterns:
+            patterns[name] = None   # until done, so recursion doesn't collapse
+            alternatives = [[piece(node) for node in alternative]
+                            for alternative in table[name]]
+            if all(None not in pieces for pieces in alternatives):
+                texts = [''.join(text for text, _, _, _ in pieces)
+                         for pieces in alternatives]
+                text = texts[0] if len(texts) == 1 else '(?>%s)' % '|'.join(texts)
+                groups = sum(p[1] for pieces in alternatives for p in pieces)
+                sparse = (any(p[2] for pieces in alternatives for p in pieces)
+                          or (1 < len(alternatives) and 0 < groups))
+                dense = all(p[3] for pieces in alternatives for p in pieces)
+                if len(text) <= _collapse_limit:
+                    patterns[name] = text, groups, sparse, dense
+        return patterns[name]
+    # Return a node's (regex text, number of groups, whether some
+    # groups may not take part, whether all tokens' groups do), or
+    # None if it has no regex.
+    def piece(node):
+        kind, x = node
+        if kind == 'literal':
+            return re.escape(_latin1(x)), 0, False, True
+        elif kind == 'regex' and _fusable(node):
+            return ('(?>%s)' % _latin1(x.pattern), x.groups, False,
+                    not _optional_groups(x))
+        elif kind in ('rule', 'call', 'opt', 'star', 'plus'):
+            inner = rule_pattern(x)
+            if inner is None: return None
+            text, groups, sparse, dense = inner
+            if kind in ('rule', 'call'): return inner
+            if kind != 'opt' and groups: return None   # a regex keeps just the last
+            op = {'opt': '?', 'star': '*', 'plus': '+'}[kind]
+            return '(?>(?:%s)%s)' % (text, op), groups, sparse or kind == 'opt', dense
+        elif kind == '!':
+            inner = piece(x)
+            if inner is None: return None
+            text, groups, sparse, dense = inner
+            return '(?!%s)' % text, groups, 0 < groups, dense
+        return None
+    def compile_node(node):
+        found = piece(node)
+        if found is None: return None
+        text, groups, sparse, dense = found
+        if sparse and not dense: return None
+        if mode != 'str': text = text.encode('latin-1')
+        return 'regular' if sparse and groups else 'regex', re.compile(text)
+    collapsed = {}
+    for name in table:
+        node = compile_node(('rule', name))
+        if node: collapsed[name] = [[node]]
+    if not collapsed: return table
+    def replace(node):
+        if node[0] in ('rule', 'call', 'opt', 'star', 'plus') and node[1] in collapsed:
+            return compile_node(node) or node
+        return node
+    table = _map_nodes(table, replace)
+    table.update(collapsed)
+    return table
+
+def _optional_groups(regex):
+    "Might some group of a compiled regex not take part in a match?"
+    def walk(items, optional):
+        for op, av in items:
+            if op == _sre_parse.SUBPATTERN:
+                if av[0] is not None and optional: return True
+                if walk(av[-1], optional): return True
+            elif op == _sre_parse.BRANCH:
+                if any(walk(each, optional or 1 < len(av[1])) for each in av[1]):
+                    return True
+            elif op in _sre_repeats:
+                if walk(av[2], optional or av[0] == 0): return True
+            elif op == _sre_parse.ASSERT_NOT:
+                if walk(av[1], True): return True
+            elif op in (_sre_parse.ASSERT, getattr(_sre_parse, 'ATOMIC_GROUP', None)):
+                if walk(av[-1] if op == _sre_parse.ASSERT else av, optional):
+                    return True
+            elif op == _sre_parse.GROUPREF_EXISTS:
+                return True
+        return False
+    if not regex.groups: return False
+    try: return walk(_sre_parse.parse(regex.pattern, regex.flags), False)
+    except Exception: return True
+
+_inline_limit = 8   # the most nodes a rule's body can have to be inlined
+
+def _inline(table, memo='all'):
+    """Return table with calls to small rules replaced by their bodies:
+    spliced into the calling alternative if a rule has just one,
+    otherwise as a 'choice' node. A choice carries on with the values
+    of the alternative it's in, so this is safe only for rules without
+    actions, which would see those values too. Rules that may call
+    themselves stay calls, as do those a memo dict asks to memoize.
+
+    >>> table = _lower(_split(r"a = b c | b   b = x _ | y   c = /z/   _ = /,/   x = /x/   y = /y/")[1], {}, 'str')
+    >>> _inline(table)['a']
+    [[('choice', [[('literal', 'x'), ('literal', ',')], [('literal', 'y')]]), ('literal', 'z')], [('choice', [[('literal', 'x'), ('literal', ',')], [('literal', 'y')]])]]
+    """
+    calls = _reachable(table)
+    keep = set(name for name in table if name in calls[name])
+    if isinstance(memo, dict): keep.update(name for name, flag in memo.items() if flag)
+    expanded = {}
+    def expand(name):
+        if name not in expanded:
+            expanded[name] = None
+            if name in keep: return None
+            body = [sequence(alternative) for alternative in table[name]]
+            if all(map(safe, body)) and sum(map(size, body)) <= _inline_limit:
+                expanded[name] = body
+        return expanded[name]
+    def sequence(nodes):
+        result = []
+        for node in nodes:
+            body = expand(node[1]) if node[0] in ('rule', 'call') else None
+            if body is not None and len(body) == 1: result.extend(body[0])
+            else: result.append(single(node))
+        return result
+    def single(node):
+        kind, x = node
+        if kind in ('rule', 'call') and expand(x) is not None:
+            return 'choice', expanded[x]
+        if kind == '!': return '!', single(x)
+        if kind == 'choice': return 'choice', [sequence(each) for each in x]
+        if kind == 'prec':
+            operand, levels = x
+            return 'prec', (single(operand),
+                            tuple((right, sequence(operator), action)
+                                  for right, operator, action in levels))
+        return node
+    def safe(nodes):
+        for kind, x in nodes:
+            if kind in ('action', 'special', 'prec'): return False
+            if kind == '!' and not safe([x]): return False
+            if kind == 'choice' and not all(map(safe, x)): return False
+        return True
+    def size(nodes):
+        return sum(1 + (size([x]) if kind == '!' else
+                        sum(map(size, x)) if kind == 'choice' else 0)
+                   for kind, x in nodes)
+    return dict((name, [sequence(alternative) for alternative in alternatives])
+                for name, alternatives in table.items())
+
+def _factor(table):
+    """Return table with each run of adjacent alternatives starting
+    the same way factored into their common prefix followed by a
+    'choice' node, whose x is the list of what's left of them. Unlike
+    a group, a choice carries on with the values of the alternative
+    it's in, so the results are the same, but the prefix gets parsed
+    once.
+
+    >>> table = _lower(_split(r"a = b c d | b c | b e | f   b = x   c = y   d = z   e = w   f = v")[1], {}, 'str')
+    >>> _factor(table)['a'][0]
+    [('rule', 'b'), ('choice', [[('rule', 'c'), ('choice', [[('rule', 'd')], []])], [('rule', 'e')]])]
+    """
+    def factor(alternatives):
+        result, i = [], 0
+        while i < len(alternatives):
+            first = alternatives[i][:1]
+            j = i + 1
+            while first and j < len(alternatives) and alternatives[j][:1] == first:
+                j += 1
+            if j - i == 1:
+                result.append(alternatives[i])
+            else:
+                run = alternatives[i:j]
+                n = 1
+                while all(n < len(alternative) and alternative[n] == run[0][n]
+                          for alternative in run):
+                    n += 1
+                rests = factor([alternative[n:] for alternative in run])
+                result.append(run[0][:n] + [('choice', rests)])
+            i = j
+        return result
+    return dict((name, factor(alternatives)) for name, alternatives in table.items())
+
+def _expand_prec(table):
+    """Return table with each operator table replaced by a call to a
+    tower of left- or right-recursive rules, one per level, named like
+    '(op1)', for the engines that don't climb precedence."""
+    towers = {}
+    count = itertools.count(1)
+    def expand(node):
+        if node[0] != 'prec': return node
+        operand, levels = node[1]
+        names = ['(op%d)' % next(count) for _ in levels]
+        for i, (right, operator, action) in enumerate(levels):
+            this = 'rule', names[i]
+            higher = ('rule', names[i+1]) if i+1 < len(levels) else operand
+            action = [('action', action)] if action else []
+            if right: towers[names[i]] = [[higher] + operator + [this] + action, [higher]]
+            else:     towers[names[i]] = [[this] + operator + [higher] + action, [higher]]
+        return 'rule', names[0]
+    table = _map_nodes(table, expand)
+    table.update(towers)
+    return table
+
+def _referenced(table, *kinds):
+    "Return the set of names of rules called by nodes of these kinds."
+    names = set()
+    def note(node):
+        if node[0] in kinds: names.add(node[1])
+        return node
+    _map_nodes(table, note)
+    return names
+
+def _memoize(table, memo):
+    """Return table with references to the rules we're not to memoize
+    changed from kind 'rule' to 'call', and to left-recursive rules
+    changed to 'left', which grow a seed parse in the memo table
+    after Warth et al., "Packrat Parsers Can Support Left Recursion".
+    (A repetition of a left-recursive rule calls it via a group named
+    like 'name(left)'.) Only direct left recursion, through the rule's
+    own groups at most, can grow: if a rule turns out to call itself
+    through another, the call raises BadGrammar. See Parser() for what
+    memo can be."""
+    left = _left_recursive(table)
+    if memo == 'all': chosen = set(table)
+    elif memo == 'none': chosen = set()
+    elif memo == 'auto' or isinstance(memo, dict):
+        chosen = _auto_memo(table)
+        for name, flag in (memo if isinstance(memo, dict) else {}).items():
+            if name not in table: raise ValueError("Unknown rule", name)
+            (chosen.add if flag else chosen.discard)(name)
+    else:
+        raise ValueError("Unknown memo policy", memo)
+    if not left and memo == 'all': return table
+    def mark(node):
+        kind, x = node
+        if kind == 'rule' and x in left: return 'left', x
+        if kind == 'rule' and x not in chosen: return 'call', x
+        if kind in ('opt', 'star', 'plus') and x in left:
+            return kind, x + '(left)'
+        return node
+    table = _map_nodes(table, mark)
+    for name in left: table[name + '(left)'] = [[('left', name)]]
+    return table
+
+def _auto_memo(table):
+    r"""Guess which rules are worth memoizing: those called at the
+    same position by more than one alternative of a rule (directly, or
+    as the first thing done by a rule that is), excluding rules that
+    are one alternative of plain regexes. Two calls look like they're
+    at the same position when the tokens preceding them, skipping any
+    that might match the empty string, are the same.
+
+    >>> grammar = r"number = int frac | int   int = (0) !\d | ([1-9]\d*)   frac = ([.]\d+)"
+    >>> table = _lower(_split(grammar)[1], {}, 'str')
+    >>> sorted(_auto_memo(table))
+    ['int']
+    >>> table = _lower(_split(r"e = ops , e | ops   num = (\d+)")[1],
+    ...                {'ops': infix('num', ('left', r'([+-])', None))}, 'str')
+    >>> sorted(_auto_memo(table))
+    []
+    """
+    nullable = _nullable(table)
+    leading = _leading(table, nullable)
+    chosen = set()
+    for alternatives in table.values():
+        seen = []   # not a set, since nodes like 'prec' hold lists
+        for alternative in alternatives:
+            prefix = ()
+            for node in alternative:
+                callee = _called(node)
+                if callee:
+                    for c in leading[callee] | set([callee]):
+                        if (prefix, c) in seen: chosen.add(c)
+                        seen.append((prefix, c))
+                if not _can_be_empty(node, nullable): prefix += (node,)
+    def simple(alternatives):
+        return (len(alternatives) == 1
+                and all(_called(node) is None and node[0] in ('!', 'literal', 'regex')
+                        for node in alternatives[0]))
+    return set(name for name in chosen if not simple(table[name]))
+
+# Both engines collect values in a rope, to append in constant time
+# instead of copying tuples: a rope is a tuple or a list [left, right]
+# of two nonempty ropes. It becomes a tuple again for a semantic
+# action or the final result.
+
+def _flatten(vals):
+    "Return the tuple of values in rope vals."
+    if vals.__class__ is tuple: return vals
+    result, ropes = [], [vals]
+    while ropes:
+        rope = ropes.pop()
+        if rope.__class__ is tuple:
+            result.extend(rope)
+        else:
+            ropes.append(rope[1])
+            ropes.append(rope[0])
+    return tuple(result)
+
+def _parse(rules, rule, text, memo, dispatch={}, start=0, profile=None):
+    # Parse text from start, returning the far position, the end
+    # position and the results tuple, or raising Unparsable. Given a
+    # profile, count and time the parse in it; see _profiled().
+
+    # Each function takes a position pos (and maybe a values rope
     # vals) and returns either (far, pos1, vals1) on success or (far,
     # None, garbage) on failure (where far is the rightmost position
     # reached in the attempt).
 
-    @_memo
+    # A rule in dispatch tries only the alternatives whose FIRST sets
+    # admit the next character. The rest would fail without getting
+    # past pos, so skipping them changes neither the result nor far.
+    end = len(text)
     def parse_rule(name, pos):
         farthest = pos
-        for alternative in rules[name]:
+        alternatives = rules[name]
+        if name in dispatch:
+            by_char, default = dispatch[name]
+            alternatives = by_char.get(text[pos] if pos < end else None, default)[0]
+        for alternative in alternatives:
             pos1, vals1 = pos, ()
-            for token in alternative:
-                far, pos1, vals1 = parse_token(token, pos1, vals1)
+            for node in alternative:
+                far, pos1, vals1 = parse_node(node, pos1, vals1)
                 farthest = max(farthest, far)
                 if pos1 is None: break
             else: return farthest, pos1, vals1
         return farthest, None, ()
 
-    def parse_token(token, pos, vals):
-        if re.match(r'!.', token):
-            _, pos1, _ = parse_token(token[1:], pos, vals)
+    def parse_node(node, pos, vals):
+        kind, x = node
+        if kind == 'literal':
+            if text.startswith(x, pos):
+                pos1 = pos + len(x)
+                return pos1, pos1, vals
+            else: return pos, None, ()
+        elif kind == 'regex':
+            m = x.match(text, pos)
+            if not m: return pos, None, ()
+            groups = m.groups()
+            if groups and vals: groups = [vals, groups]
+            return m.end(), m.end(), groups or vals
+        elif kind == 'regular':
+            m = x.match(text, pos)
+            if not m: return pos, None, ()
+            groups = tuple(group for group in m.groups() if group is not None)
+            if groups and vals: groups = [vals, groups]
+            return m.end(), m.end(), groups or vals
+        elif kind == 'fused':
+            pattern, n, _ = x
+            m = pattern.match(text, pos)
+            if not m: return pos, None, ()
+            if m.lastindex != n + 1: return m.end(), None, ()
+            if not n: return m.end(), m.end(), vals
+            groups = m.groups()[:n]
+            return m.end(), m.end(), [vals, groups] if vals else groups
+        elif kind == 'rule':
+            far, pos1, vals1 = memo_rule(x, pos)
+            if vals1 and vals: vals1 = [vals, vals1]
+            return far, pos1, vals1 or vals
+        elif kind == 'call':
+            far, pos1, vals1 = parse_rule(x, pos)
+            if vals1 and vals: vals1 = [vals, vals1]
+            return far, pos1, vals1 or vals
+        elif kind == 'left':
+            far, pos1, vals1 = grow_rule(x, pos)
+            if vals1 and vals: vals1 = [vals, vals1]
+            return far, pos1, vals1 or vals
+        elif kind in ('opt', 'star', 'plus'):
+            # x+ is x x*, and x* stops after an empty match.
+            farthest = pos
+            if kind == 'plus':
+                farthest, pos, vals = parse_node(('call', x), pos, vals)
+                if pos is None: return farthest, None, ()
+            while True:
+                far, pos1, vals1 = parse_rule(x, pos)
+                farthest = max(farthest, far)
+                if pos1 is None: break
+                if vals1: vals = [vals, vals1] if vals else vals1
+                done, pos = kind == 'opt' or pos1 == pos, pos1
+                if done: break
+            return farthest, pos, vals
+        elif kind == 'action':
+            return pos, pos, (x(*_flatten(vals)),)
+        elif kind == 'special':
+            return x(text, pos, _flatten(vals))
+        elif kind == 'choice':
+            farthest = pos
+            for alternative in x:
+                pos1, vals1 = pos, vals
+                for node in alternative:
+                    far, pos1, vals1 = parse_node(node, pos1, vals1)
+                    farthest = max(farthest, far)
+                    if pos1 is None: break
+                else: return farthest, pos1, vals1
+            return farthest, None, ()
+        elif kind == 'prec':
+            far, pos1, vals1 = climb(x, pos, 0)
+            if vals1 and vals: vals1 = [vals, vals1]
+            return far, pos1, vals1 or vals
+        elif kind == 'error':
+            raise BadGrammar(*x)
+        else:
+            _, pos1, _ = parse_node(x, pos, vals)
             return pos, pos if pos1 is None else None, vals
-        elif token in rules:
-            far, pos1, vals1 = parse_rule(token, pos)
-            return far, pos1, pos1 is not None and vals + vals1
-        elif token in actions:
-            f = actions[token]
-            if hasattr(f, 'peglet_action'): return f(text, pos, vals) 
-            else: return pos, pos, (f(*vals),)
+
+    # Precedence climbing: parse an operand, then operators of this
+    # level or higher, each with its right operand parsed at the next
+    # level up (or at the same level, if right-associative).
+    def climb(prec, pos, least):
+        operand, levels = prec
+        farthest, pos, vals = parse_node(operand, pos, ())
+        if pos is None: return farthest, None, ()
+        level = len(levels) - 1
+        while least <= level:
+            right, operator, action = levels[level]
+            pos1, vals1 = pos, vals
+            for node in operator:
+                far, pos1, vals1 = parse_node(node, pos1, vals1)
+                farthest = max(farthest, far)
+                if pos1 is None: break
+            else:
+                far, pos1, vals2 = climb(prec, pos1, level + (not right))
+                farthest = max(farthest, far)
+                if pos1 is not None:
+                    if vals2 and vals1: vals2 = [vals1, vals2]
+                    pos, vals = pos1, vals2 or vals1
+                    if action: vals = (action(*_flatten(vals)),)
+                    if right: level -= 1
+                    continue
+            level -= 1
+        return farthest, pos, vals
+
+    def memo_rule(name, pos):
+        result = memo.get(name, pos)
+        if result is None:
+            result = parse_rule(name, pos)
+            memo.put(name, pos, result)
+        return result
+
+    # A left-recursive call at the same position gets the best parse
+    # so far, starting from failure; we reparse until it stops growing.
+    # The rules growing at once nest, so a call back to any but the
+    # innermost one is indirect left recursion.
+    growing, growth = {}, []
+    def grow_rule(name, pos):
+        seed = growing.get((name, pos))
+        if seed is not None:
+            if growth[-1] != (name, pos): raise _indirect(name)
+            return seed
+        seed = memo.get(name, pos)
+        if seed is not None: return seed
+        growing[name, pos] = seed = pos, None, ()
+        growth.append((name, pos))
+        farthest = pos
+        while True:
+            far, pos1, vals1 = parse_rule(name, pos)
+            farthest = max(farthest, far)
+            if pos1 is None or (seed[1] is not None and pos1 <= seed[1]): break
+            growing[name, pos] = seed = far, pos1, vals1
+        del growing[name, pos]
+        growth.pop()
+        result = farthest, seed[1], seed[2]
+        memo.put(name, pos, result)
+        return result
+
+    if profile is not None:
+        parse_rule, parse_node, memo_rule = _profiled(profile, rules, text, memo,
+                                                      dispatch, parse_node)
+    far, pos, vals = parse_rule(_start(rules, rule), start)
+    if pos is None: raise _unparsable(rule, text, far)
+    else: return far, pos, _flatten(vals)
+
+def _in_action(tb):
+    """Given the traceback of a RecursionError out of _parse(), did it
+    come from code outside peglet, like a semantic action recursing,
+    more than from the parse? Its frames count after the last of
+    peglet's."""
+    inside = outside = 0
+    while tb is not None:
+        if tb.tb_frame.f_globals is globals(): inside, outside = inside + outside + 1, 0
+        else: outside += 1
+        tb = tb.tb_next
+    return inside < outside
+
+def _indirect(name):
+    return BadGrammar("Indirectly left-recursive rule", name)
+
+def _start(table, rule):
+    "Return the name of the rule to call to start parsing with rule."
+    return rule + '(left)' if rule + '(left)' in table else rule
+
+def _unparsable(rule, text, far):
+    before, after = text[:far], text[far:]
+    if not hasattr(before, 'startswith'): # A memoryview, say.
+        before, after = bytes(before), bytes(after)
+    return Unparsable(rule, before, after)
+
+# Profiling: given a profile, _parse() swaps in versions of its
+# parse_rule(), parse_node() and memo_rule() that count and time what
+# they do, so that an unprofiled parse pays nothing for them. A rule's
+# self time leaves out the rules it calls; its time counts just the
+# outermost of its calls, when it recurses, as in cProfile.
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+_terminals = ('literal', 'regex', 'regular', 'fused')
+
+def _profiled(profile, rules, text, memo, dispatch, parse_node):
+    """Return profiling versions of _parse()'s parse_rule(), parse_node()
+    and memo_rule() for rules and text, where parse_node is the plain
+    one. profile pairs the dict to add to, from rule names to their
+    counts and times, with a dict from id(action) to action name."""
+    counts, action_names = profile
+    end = len(text)
+    by_alternative, active = {}, {}
+    # A frame per rule being parsed: its counts, its current
+    # alternative's, and the time spent so far in rules it called.
+    frames = [[None, None, 0.0]]
+    def rule_counts(name):
+        if name not in counts:
+            counts[name] = dict(calls=0, hits=0, misses=0, succeeded=0,
+                                tested=0, skipped=0, tries=0, fails=0,
+                                time=0.0, self=0.0, alternatives={})
+        return counts[name]
+    def alternative_counts(name, alternative):
+        if id(alternative) not in by_alternative:
+            by_alternative[id(alternative)] = \
+                rule_counts(name)['alternatives'].setdefault(
+                    _render(alternative, action_names),
+                    dict(tried=0, succeeded=0, tries=0, fails=0, self=0.0))
+        return by_alternative[id(alternative)]
+
+    def parse_rule(name, pos):
+        here = rule_counts(name)
+        here['calls'] += 1
+        farthest, result = pos, None
+        alternatives = rules[name]
+        if name in dispatch:
+            by_char, default = dispatch[name]
+            alternatives, tested, skipped = by_char.get(
+                text[pos] if pos < end else None, default)
+            here['tested'] += tested
+            here['skipped'] += skipped
+        frame = [here, None, 0.0]
+        frames.append(frame)
+        active[name] = active.get(name, 0) + 1
+        started = _timer()
+        for alternative in alternatives:
+            frame[1] = counted = alternative_counts(name, alternative)
+            counted['tried'] += 1
+            began, before = _timer(), frame[2]
+            pos1, vals1 = pos, ()
+            for node in alternative:
+                far, pos1, vals1 = parse_node_counted(node, pos1, vals1)
+                farthest = max(farthest, far)
+                if pos1 is None: break
+            counted['self'] += _timer() - began - (frame[2] - before)
+            if pos1 is not None:
+                counted['succeeded'] += 1
+                result = farthest, pos1, vals1
+                break
+        elapsed = _timer() - started
+        frames.pop()
+        active[name] -= 1
+        if not active[name]: here['time'] += elapsed
+        here['self'] += elapsed - frame[2]
+        frames[-1][2] += elapsed
+        if result is None: return farthest, None, ()
+        here['succeeded'] += 1
+        return result
+
+    def parse_node_counted(node, pos, vals):
+        result = parse_node(node, pos, vals)
+        if node[0] in _terminals:
+            here, counted, _ = frames[-1]
+            failed = result[1] is None
+            here['tries'] += 1
+            here['fails'] += failed
+            counted['tries'] += 1
+            counted['fails'] += failed
+        return result
+
+    def memo_rule(name, pos):
+        result = memo.get(name, pos)
+        if result is None:
+            rule_counts(name)['misses'] += 1
+            result = parse_rule(name, pos)
+            memo.put(name, pos, result)
         else:
-            if re.match(_identifier+'$', token):
-                raise BadGrammar("Missing rule", token)
-            if re.match(r'/.+/$', token): token = token[1:-1]
-            m = re.match(token, text[pos:])
-            if m: return pos + m.end(), pos + m.end(), vals + m.groups()
-            else: return pos, None, ()
+            rule_counts(name)['hits'] += 1
+        return result
+
+    return parse_rule, parse_node_counted, memo_rule
+
+# A parsing machine
 
-    far, pos, vals = parse_rule(rule, 0)
-    if pos is None: raise Unparsable(rule, text[:far], text[far:])
-    else: return vals
+# The interpreter above uses a Python call for each rule and token
+# it tries. This alternative, after LPeg, compiles the grammar to a
+# list of instructions (op, arg) and runs them in one loop, keeping
+# its call and backtrack stacks in flat lists. A rule's code is its
+# alternatives, each but the last guarded by 'choice' and 'commit',
+# followed by 'return' and then by 'rulefail'. A backtrack entry is
+# four items: where to resume, the pos and vals to restore there, and
+# the far to restore (or -1 to keep the current far, which for plain
+# choices should keep growing). A call frame is five items: the return
+# address, the caller's vals and far, and the callee's name (or None if
+# it's not memoized) and start position, for its memo entry. A
+# repetition is a 'choice' and a call, looping back with 'loop'. A
+# left-recursive rule starts with 'seed' and ends with 'grow' and
+# 'growfail' in place of 'return' and 'rulefail', keeping its seed
+# parses in a dict like the interpreter's.
+
+def _assemble(table, mode='str', regex_firsts=None):
+    """Compile a table from _lower() into a program for _run_vm():
+    a dict mapping each rule name to its (name, entry, fail) addresses,
+    plus the instruction list under the key None. An alternative with
+    a FIRST set starts by testing the next character against it, to
+    skip to the next alternative without pushing a choice."""
+    code = [('halt', None)]
+    calls = {}
+    def emit(op, arg=None):
+        code.append([op, arg])
+        return code[-1]
+    def comp_node(node):
+        kind, x = node
+        if kind in ('rule', 'call', 'left'):
+            emit('call', (x, kind != 'call'))
+        elif kind == '!':
+            negation = emit('not')
+            comp_node(x)
+            emit('failtwice')
+            negation[1] = len(code)
+        elif kind == 'opt':
+            choice = emit('choice')
+            emit('call', (x, False))
+            choice[1] = len(code) + 1
+            emit('commit', len(code) + 1)
+        elif kind == 'choice':
+            comp_choice(x)
+        elif kind in ('star', 'plus'):
+            if kind == 'plus': emit('call', (x, False))
+            loop = emit('choice')
+            emit('call', (x, False))
+            emit('loop', len(code) - 2)
+            loop[1] = len(code)
+        else:
+            emit(kind, x)
+    def test(codes):
+        if codes is None: return [None, None, None]
+        keys = frozenset().union(*[_keys(code, mode) for code in codes
+                                   if code != _high])
+        return emit('test', [keys, mode == 'str' and _high in codes, None])[1]
+    def comp_choice(alternatives, firsts=None):
+        commits = []
+        firsts = firsts or [None] * len(alternatives)
+        for alternative, codes in zip(alternatives[:-1], firsts):
+            skip = test(codes)
+            choice = emit('choice')
+            for node in alternative: comp_node(node)
+            commits.append(emit('commit'))
+            choice[1] = skip[2] = len(code)
+        test(firsts[-1])
+        for node in alternatives[-1]: comp_node(node)
+        for commit in commits: commit[1] = len(code)
+    left, firsts = _referenced(table, 'left'), _first(table, regex_firsts)
+    for name, alternatives in table.items():
+        entry = len(code)
+        if name in left: emit('seed')
+        comp_choice(alternatives, firsts[name])
+        if name in left:
+            emit('grow', (entry + 1, len(code) + 1))
+            emit('growfail')
+        else:
+            emit('return')
+            emit('rulefail')
+        calls[name] = name, entry, len(code) - 1
+    code = [('call', (arg[0] if arg[1] else None,) + calls[arg[0]][1:])
+            if op == 'call' else (op, arg)
+            for op, arg in code]
+    calls[None] = code
+    return calls
+
+def _run_vm(program, rule, text, memo, start=0):
+    "Run program like _parse() runs a table."
+    code = program[None]
+    _, pc, fail = program[_start(program, rule)]
+    growing, growth = {}, []
+    end = len(text)
+    pos, vals, far = start, (), start
+    frames = [0, (), start, None, start]
+    backtrack = [fail, start, (), -1]
+    check_at = 5 * 10000   # frames' length at which to look for a loop
+    while True:
+        op, arg = code[pc]
+        if op == 'literal':
+            if text.startswith(arg, pos):
+                pos += len(arg)
+                if far < pos: far = pos
+                pc += 1
+                continue
+        elif op == 'regex':
+            m = arg.match(text, pos)
+            if m:
+                pos = m.end()
+                if far < pos: far = pos
+                groups = m.groups()
+                if groups: vals = [vals, groups] if vals else groups
+                pc += 1
+                continue
+        elif op == 'regular':
+            m = arg.match(text, pos)
+            if m:
+                pos = m.end()
+                if far < pos: far = pos
+                groups = tuple(group for group in m.groups() if group is not None)
+                if groups: vals = [vals, groups] if vals else groups
+                pc += 1
+                continue
+        elif op == 'fused':
+            pattern, n, _ = arg
+            m = pattern.match(text, pos)
+            if m:
+                if far < m.end(): far = m.end()
+                if m.lastindex == n + 1:
+                    pos = m.end()
+                    if n:
+                        groups = m.groups()[:n]
+                        vals = [vals, groups] if vals else groups
+                    pc += 1
+                    continue
+        elif op == 'call':
+            name, entry, fail = arg
+            if growing and (name, pos) in growing:
+                if growth[-1] != (name, pos): raise _indirect(name)
+                entry = growing[name, pos]
+            else:
+                entry = name is not None and memo.get(name, pos)
+            if not entry:
+                frames.extend((pc + 1, vals, far, name, pos))
+                if check_at < len(frames):
+                    _check_progress(program, frames)
+                    check_at *= 2
+                backtrack.extend((fail, pos, vals, -1))
+                pc, vals, far = arg[1], (), pos
+                continue
+            far1, pos1, vals1 = entry
+            if far < far1: far = far1
+            if pos1 is not None:
+                pos = pos1
+                if vals1: vals = [vals, vals1] if vals else vals1
+                pc += 1
+                continue
+        elif op == 'return':
+            del backtrack[-4:]
+            start = frames.pop(); name = frames.pop()
+            far1 = frames.pop(); vals1 = frames.pop(); pc = frames.pop()
+            if name is not None: memo.put(name, start, (far, pos, vals))
+            if vals1: vals = [vals1, vals] if vals else vals1
+            if far < far1: far = far1
+            continue
+        elif op == 'test':
+            keys, high, skip = arg
+            char = text[pos] if pos < end else None
+            if char in keys or (high and char is not None and _high <= ord(char)):
+                pc += 1
+                continue
+            if skip is not None:
+                pc = skip
+                continue
+        elif op == 'choice':
+            backtrack.extend((arg, pos, vals, -1))
+            pc += 1
+            continue
+        elif op == 'commit':
+            del backtrack[-4:]
+            pc = arg
+            continue
+        elif op == 'loop':
+            # Like commit, but leave the loop after an empty match.
+            pc = arg if pos != backtrack[-3] else pc + 1
+            del backtrack[-4:]
+            continue
+        elif op == 'action':
+            vals = (arg(*_flatten(vals)),)
+            pc += 1
+            continue
+        elif op == 'special':
+            far1, pos1, vals1 = arg(text, pos, _flatten(vals))
+            if far < far1: far = far1
+            if pos1 is not None:
+                pos, vals = pos1, vals1
+                pc += 1
+                continue
+        elif op == 'not':
+            backtrack.extend((arg, pos, vals, far))
+            pc += 1
+            continue
+        elif op == 'failtwice':
+            far = backtrack[-1]
+            del backtrack[-4:]
+        elif op == 'rulefail':
+            start = frames.pop(); name = frames.pop()
+            far1 = frames.pop(); del frames[-2:]
+            if name is not None: memo.put(name, start, (far, None, ()))
+            if far < far1: far = far1
+        elif op == 'seed':
+            growing[frames[-2], pos] = pos, None, ()
+            growth.append((frames[-2], pos))
+            pc += 1
+            continue
+        elif op == 'grow':
+            del backtrack[-4:]
+            start = frames[-1]; name = frames[-2]
+            seed = growing[name, start]
+            if seed[1] is None or seed[1] < pos:
+                growing[name, start] = far, pos, vals
+                backtrack.extend((arg[1], start, (), -1))
+                pc, pos, vals = arg[0], start, ()
+            else:
+                pc = arg[1]
+            continue
+        elif op == 'growfail':
+            start = frames.pop(); name = frames.pop()
+            far1 = frames.pop(); vals1 = frames.pop(); pc = frames.pop()
+            _, pos, vals = growing.pop((name, start))
+            growth.pop()
+            memo.put(name, start, (far, pos, vals))
+            if far < far1: far = far1
+            if pos is not None:
+                if vals1: vals = [vals1, vals] if vals else vals1
+                continue
+        elif op == 'halt':
+            return far, pos, _flatten(vals)
+        else:
+            raise BadGrammar(*arg)
+        # Fail: resume at the most recent backtrack entry.
+        if not backtrack: raise _unparsable(rule, text, far)
+        far1 = backtrack.pop(); vals = backtrack.pop()
+        pos = backtrack.pop(); pc = backtrack.pop()
+        if 0 <= far1: far = far1
+
+def _check_progress(program, frames):
+    """Raise BadGrammar if two of _run_vm()'s unfinished calls came
+    from the same place at the same position, since then it would go
+    on calling forever, never consuming input (the interpreter would
+    run out of stack). The machine checks each time its stack doubles."""
+    code, seen = program[None], set()
+    for i in range(0, len(frames), 5):
+        call = frames[i], frames[i + 4]
+        if call in seen:
+            entry = code[frames[i] - 1][1][1]
+            names = [name for name in program
+                     if name is not None and program[name][1] == entry]
+            raise BadGrammar("Recursion without progress", names[0])
+        seen.add(call)
 
 # Conveniences
 
@@ -209,6 +2437,120 @@ def OneResult(parser):
         return results[0]
     return parse
 
+def infix(operand, *levels):
+    r"""Return an operator-precedence table, to define as an action and
+    use in a grammar like a rule: it matches operand tokens separated
+    by infix operators. levels go from lowest to highest precedence;
+    each is a tuple (associativity, operator, action) where
+    associativity is 'left' or 'right', operator is a string of
+    tokens matching the operator, and action (or None) combines the
+    results of two operands and the operator between them.
+
+    >>> arith = Parser(r"expr = ops   num = (\d+) int", int=int,
+    ...                ops=infix('num', ('left', r'([+-])', hug),
+    ...                                 ('right', r'(\^)', hug)))
+    >>> arith('1-2^3^4+5')
+    (((1, '-', (2, '^', (3, '^', 4))), '+', 5),)
+    """
+    return _Infix(operand, levels)
+
+class _Infix(object):
+    def __init__(self, operand, levels):
+        self.operand, self.levels = operand, []
+        for assoc, operator, action in levels:
+            if assoc not in ('left', 'right'):
+                raise ValueError("Unknown associativity", assoc)
+            self.levels.append((assoc == 'right', operator, action))
+
+def factoring_report(grammar, **actions):
+    r"""Return a diff of grammar's rules against how Parser() factors
+    their common prefixes (showing a factored choice in parentheses),
+    or '' if it doesn't.
+
+    >>> print(factoring_report(r"n = int frac join | int join   int = (\d+)   frac = (\.\d+)",
+    ...                        join=join))
+    --- grammar
+    +++ factored
+    @@ -1,3 +1,3 @@
+    -n = int frac join | int join
+    +n = int ( frac join | join )
+     int = (\d+)
+     frac = (\.\d+)
+    <BLANKLINE>
+    """
+    import difflib
+    names, rules = _split(grammar)
+    table = _lower(rules, actions, 'str')
+    action_names = dict((id(f), name) for name, f in actions.items())
+    def render(table):
+        return ['%s = %s\n' % (name, ' | '.join(_render(alternative, action_names)
+                                                for alternative in table[name]))
+                for name in names + sorted(set(table) - set(names))]
+    return ''.join(difflib.unified_diff(render(table), render(_factor(table)),
+                                        'grammar', 'factored'))
+
+def profile_report(profile, sort='self'):
+    r"""Return a table of the counts and times in the profile of a
+    parsing function made with profile=True: a line per rule, the
+    highest by `sort` first, followed by a line per alternative of
+    it that got tried, with the rule's calls column counting its
+    tries. Times are in milliseconds. A last line totals how many
+    alternatives got tested against the next character, and skipped.
+
+    >>> parse = Parser(r"word = (\d+) hug | ([a-z]+)", hug=hug,
+    ...                options=dict(profile=True))
+    >>> parse('hi')
+    ('hi',)
+    >>> report = profile_report(parse.profile).split('\n')
+    >>> print('\n'.join([report[0], report[-1]]))
+       calls     hits   misses  succeeded   tested  skipped    tries    fails     time     self  rule
+    skipped 1 of 2 alternatives tested (50%)
+    """
+    columns = ('calls', 'hits', 'misses', 'succeeded', 'tested', 'skipped',
+               'tries', 'fails', 'time', 'self')
+    if sort not in columns: raise ValueError("Unknown sort key", sort)
+    line = '%8s %8s %8s %10s %8s %8s %8s %8s %8s %8s  %s'
+    def row(counts, label, rename={}):
+        fields = [counts.get(rename.get(column, column), '') for column in columns]
+        fields = ['%.3f' % (field * 1000) if isinstance(field, float) else field
+                  for field in fields]
+        return line % tuple(fields + [label])
+    lines = [line % (columns + ('rule',))]
+    # Alternatives have no memo counts or cumulative time of their own.
+    by = dict(calls='tried', hits='tried', misses='tried', tested='tried',
+              skipped='tried', time='self').get(sort, sort)
+    for name in sorted(profile, key=lambda name: (-profile[name][sort], name)):
+        lines.append(row(profile[name], name))
+        alternatives = profile[name]['alternatives']
+        for text in sorted(alternatives,
+                           key=lambda text: (-alternatives[text][by], text)):
+            lines.append(row(alternatives[text], '  | ' + text, {'calls': 'tried'}))
+    tested = sum(counts['tested'] for counts in profile.values())
+    skipped = sum(counts['skipped'] for counts in profile.values())
+    lines.append('skipped %d of %d alternatives tested (%.0f%%)'
+                 % (skipped, tested, 100.0 * skipped / max(tested, 1)))
+    return '\n'.join(lines)
+
+def _render(nodes, action_names):
+    """Spell out a sequence of nodes from _lower() as grammar tokens,
+    given a dict from id(action) to action name."""
+    def spell(s):
+        return s.decode('utf-8', 'replace') if isinstance(s, bytes) and bytes is not str else s
+    def render(node):
+        kind, x = node
+        if kind == '!': return '!' + render(x)
+        if kind == 'choice':
+            return '( %s )' % ' | '.join(_render(alternative, action_names)
+                                         for alternative in x)
+        if kind in ('action', 'special'): return action_names.get(id(x), '?')
+        if kind == 'prec': return 'infix(%s)' % render(x[0])
+        if kind == 'literal': return re.sub(r'([\\.^$*+?{}\[\]|()])', r'\\\1', spell(x))
+        if kind in ('regex', 'regular'): return spell(x.pattern)
+        if kind == 'fused': return spell(x[0].pattern)
+        if kind == 'error': return x[1]
+        return x + {'opt': '?', 'star': '*', 'plus': '+'}.get(kind, '')
+    return ' '.join(map(render, nodes))
+
 # Some often-used actions:
 
 def hug(*xs):
@@ -223,3 +2565,302 @@ def position(text, pos, vals):
     "A peglet action: always succeed, producing the current position."
     return pos, pos, vals + (pos,)
 position.peglet_action = True
+
+# Compiling to Python source
+
+def compile_to_source(grammar, actions_module=None, memo='all'):
+    r"""Return the source code of a Python module defining a function
+    parse(text, rule=<the first rule>) that parses str input just like
+    Parser(grammar, **actions) would, where the actions are those
+    defined in actions_module (a module or the name of one; the
+    generated module imports them from it), and memo is as for
+    Parser()'s memo option. The generated module, in ASCII, does no
+    grammar processing when imported, runs on any Python that peglet
+    does, and needs peglet only to share its exception classes.
+
+    >>> grammar = r"pairs = pair ,\s* pairs | pair   pair = (\w+)=(\d+) hug"
+    >>> source = compile_to_source(grammar, actions_module='peglet')
+    >>> module = {}
+    >>> exec(source, module)
+    >>> module['parse']('a=1, b=2; c=3')
+    (('a', '1'), ('b', '2'))
+    >>> module['parse']('a=x')
+    Traceback (most recent call last):
+    Unparsable: ('pairs', '', 'a=x')
+
+    A repetition inside a choice or a negation backtracks as it does
+    with Parser():
+
+    >>> grammar = r"s = !\d (\w) , | (\w) ( x+ ; | )   x = (b)"
+    >>> exec(compile_to_source(grammar), module)
+    >>> module['parse']('abb'), Parser(grammar)('abb')
+    (('a',), ('a',))
+    """
+    analysis = _grammar(grammar)
+    names, rules = analysis.names, analysis.rules
+    if isinstance(actions_module, _strings):
+        actions_module = __import__(actions_module, fromlist=['*'])
+    actions = vars(actions_module) if actions_module else {}
+    table = _memoize(_expand_prec(_lower(rules, actions, 'str')), memo)
+    # Not fused, since atomic groups would tie the module to Python 3.11+.
+    table = _factor(_inline(table, memo))
+    memoized, left = _referenced(table, 'rule'), _referenced(table, 'left')
+    firsts = _first(table, analysis.regex_firsts)
+    imports = [name for name in sorted(_names_used(rules) - set(rules))
+               if name in actions]
+    action_names = dict((id(actions[name]), 'action_' + name) for name in imports)
+    for name in imports:
+        if isinstance(actions[name], _Infix):
+            for i, (_, _, action) in enumerate(actions[name].levels):
+                action_names[id(action)] = 'action_%s.levels[%d][2]' % (name, i)
+    groups = sorted(name for name in table if name not in rules)
+    def function(name, prefix=None):
+        if name in rules: return (prefix or 'rule_') + name
+        return (prefix or 'group_') + re.sub(r'\W', '_', name).rstrip('_')
+    patterns, first_sets = [], []
+    counter = itertools.count()
+
+    def comp():
+        yield '# Generated by peglet.compile_to_source() from this grammar:'
+        for line in grammar.strip('\n').split('\n'):
+            line = re.sub(r'[^\x00-\x7f]+',   # escaped as in a literal
+                          lambda m: _ascii(m.group()).lstrip('bu')[1:-1], line)
+            yield ('#   ' + line).rstrip()
+        yield ''
+        yield 'import re'
+        yield 'try:'
+        yield '    from peglet import BadGrammar, Unparsable'
+        yield 'except ImportError:'
+        yield '    class BadGrammar(Exception): pass'
+        yield '    class Unparsable(Exception): pass'
+        if imports:
+            yield 'from %s import %s' % (
+                actions_module.__name__,
+                ', '.join('%s as action_%s' % (name, name) for name in imports))
+        yield ''
+        yield 'def parse(text, rule=%s):' % _ascii(names[0])
+        yield '    far, pos, vals = rules[rule](text, 0, {})'
+        yield '    if pos is None: raise Unparsable(rule, text[:far], text[far:])'
+        yield '    return flatten(vals)'
+        yield ''
+        yield 'once = (None,)'
+        yield ''
+        yield 'def flatten(vals):'
+        yield '    if vals.__class__ is tuple: return vals'
+        yield '    result, ropes = [], [vals]'
+        yield '    while ropes:'
+        yield '        rope = ropes.pop()'
+        yield '        if rope.__class__ is tuple: result.extend(rope)'
+        yield '        else: ropes.extend((rope[1], rope[0]))'
+        yield '    return tuple(result)'
+        yield ''
+        body = [line for k, name in enumerate(names + groups)
+                     for line in comp_rule(k, name, table[name])]
+        for k, pattern in enumerate(patterns):
+            yield 're%d = re.compile(%s)' % (k, _ascii(pattern))
+        for k, keys in enumerate(first_sets):
+            yield 'first%d = frozenset(%s)' % (k, _ascii(keys))
+        for line in body:
+            yield line
+        yield ''
+        yield 'rules = {%s}' % ', '.join('%s: %s' % (_ascii(name), function(name))
+                                         for name in names)
+
+    # A rule compiles to a function like the interpreter's parse_rule.
+    # Each alternative is the body of a one-shot for-loop, to fail
+    # with break or else succeed, guarded by a test of the next
+    # character c if the alternative has a FIRST set.
+    # A left-recursive rule's function grows a seed parse in the memo,
+    # calling another function for the rule's alternatives. Seeds are
+    # lists, to tell them from final results, and memo[None] is the
+    # key of the innermost one growing.
+    def comp_rule(k, name, alternatives):
+        if name in left:
+            yield ''
+            yield 'def %s(text, pos, memo):' % function(name)
+            yield '    key = %d, pos' % k
+            yield '    try: result = memo[key]'
+            yield '    except KeyError: pass'
+            yield '    else:'
+            yield '        if result.__class__ is list and memo[None] != key:'
+            yield '            raise BadGrammar(%r, %s)' % (
+                "Indirectly left-recursive rule", _ascii(name))
+            yield '        return result'
+            yield '    top, memo[None] = memo.get(None), key'
+            yield '    memo[key] = seed = [pos, None, ()]'
+            yield '    far = pos'
+            yield '    while True:'
+            yield '        f, p, v = %s(text, pos, memo)' % function(name, 'grow_')
+            yield '        if far < f: far = f'
+            yield '        if p is None or (seed[1] is not None and p <= seed[1]): break'
+            yield '        memo[key] = seed = [f, p, v]'
+            yield '    memo[None] = top'
+            yield '    memo[key] = result = far, seed[1], seed[2]'
+            yield '    return result'
+        yield ''
+        yield 'def %s(text, pos, memo):' % (
+            function(name, 'grow_' if name in left else None))
+        if name in memoized and name not in left:
+            yield '    key = %d, pos' % k
+            yield '    try: return memo[key]'
+            yield '    except KeyError: pass'
+        yield '    far = pos'
+        if any(codes is not None for codes in firsts[name]):
+            yield '    c = text[pos] if pos < len(text) else None'
+        for alternative, codes in zip(alternatives, firsts[name]):
+            for line in comp_alternative(name, alternative, codes):
+                yield line
+        if name in memoized and name not in left:
+            yield '    memo[key] = result = far, None, ()'
+            yield '    return result'
+        else:
+            yield '    return far, None, ()'
+
+    def comp_alternative(name, alternative, codes):
+        indent = '    '
+        if codes is not None:
+            # With every high code in, test for the ones out.
+            high = _high in codes
+            if high: codes = set(range(_high)) - codes
+            keys = sorted(set().union(*[_keys(code, 'str') for code in codes]))
+            if keys not in first_sets: first_sets.append(keys)
+            test = 'c in first%d' % first_sets.index(keys)
+            if high: test = 'c is not None and c not in first%d' % first_sets.index(keys)
+            yield indent + 'if %s:' % test
+            indent += '    '
+        yield indent + 'for _ in once:'
+        yield indent + '    p, v = pos, ()'
+        for node in alternative:
+            for line in comp_node(node):
+                yield indent + '    ' + line
+        yield indent + 'else:'
+        if name in memoized and name not in left:
+            yield indent + '    memo[key] = result = far, p, v'
+            yield indent + '    return result'
+        else:
+            yield indent + '    return far, p, v'
+
+    # Code for a node updates p, v and far on success, or breaks.
+    def comp_node(node):
+        kind, x = node
+        if kind == 'literal':
+            yield 'if not text.startswith(%s, p): break' % _ascii(x)
+            yield 'p += %d' % len(x)
+            yield 'if far < p: far = p'
+        elif kind == 'regex':
+            if x.pattern not in patterns: patterns.append(x.pattern)
+            yield 'm = re%d.match(text, p)' % patterns.index(x.pattern)
+            yield 'if not m: break'
+            yield 'p = m.end()'
+            yield 'if far < p: far = p'
+            if x.groups: yield 'v = [v, m.groups()] if v else m.groups()'
+        elif kind in ('rule', 'call', 'left'):
+            yield 'f, p, vs = %s(text, p, memo)' % function(x)
+            yield 'if far < f: far = f'
+            yield 'if p is None: break'
+            yield 'if vs: v = [v, vs] if v else vs'
+        elif kind == 'opt':
+            n = next(counter)
+            yield 'f, p%d, vs = %s(text, p, memo)' % (n, function(x))
+            yield 'if far < f: far = f'
+            yield 'if p%d is not None:' % n
+            yield '    p = p%d' % n
+            yield '    if vs: v = [v, vs] if v else vs'
+        elif kind in ('star', 'plus'):
+            if kind == 'plus':
+                for line in comp_node(('call', x)): yield line
+            # The position to try from next goes in a variable of its
+            # own, since p1 and so on may be saving an enclosing node's.
+            n = next(counter)
+            yield 'while True:'
+            yield '    f, p%d, vs = %s(text, p, memo)' % (n, function(x))
+            yield '    if far < f: far = f'
+            yield '    if p%d is None: break' % n
+            yield '    if vs: v = [v, vs] if v else vs'
+            yield '    p, p%d = p%d, p' % (n, n)
+            yield '    if p == p%d: break' % n
+        elif kind == 'action':
+            yield 'v = (%s(*flatten(v)),)' % action_names[id(x)]
+        elif kind == 'special':
+            yield 'f, p, v = %s(text, p, flatten(v))' % action_names[id(x)]
+            yield 'if far < f: far = f'
+            yield 'if p is None: break'
+        elif kind == 'error':
+            yield 'raise BadGrammar%s' % _ascii(x)
+        elif kind == 'choice':
+            # The first alternative to succeed breaks out of the outer
+            # loop; if none does, p becomes None.
+            n = next(counter)
+            yield 'p%d, v%d = p, v' % (n, n)
+            yield 'for _ in once:'
+            for k, alternative in enumerate(x):
+                if k: yield '    p, v = p%d, v%d' % (n, n)
+                yield '    for _ in once:'
+                for node in alternative:
+                    for line in comp_node(node):
+                        yield '        ' + line
+                if not alternative: yield '        pass'
+                yield '    else:'
+                yield '        break'
+            yield '    p = None'
+            yield 'if p is None: break'
+        else:
+            n = next(counter)
+            yield 'p%d, v%d, far%d = p, v, far' % (n, n, n)
+            yield 'for _ in once:'
+            for line in comp_node(x):
+                yield '    ' + line
+            yield 'else:'
+            yield '    far = far%d' % n
+            yield '    break'
+            yield 'p, v, far = p%d, v%d, far%d' % (n, n, n)
+
+    return '\n'.join(comp()) + '\n'
+
+def _main(argv):
+    r"""Run `python -m peglet` with the arguments argv, returning the
+    exit status. Its compile command writes compile_to_source()'s
+    module for a grammar file.
+
+    >>> import shutil, tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> with open(os.path.join(folder, 'pairs.peg'), 'w') as f:
+    ...     _ = f.write(r"pairs = pair ,\s* pairs | pair   pair = (\w+)=(\d+) hug")
+    >>> _main(['compile', os.path.join(folder, 'pairs.peg'), '-a', 'peglet',
+    ...        '-o', os.path.join(folder, 'pairs_parser.py')])
+    0
+    >>> sys.path.insert(0, folder)
+    >>> import pairs_parser
+    >>> pairs_parser.parse('a=1, b=2; c=3')
+    (('a', '1'), ('b', '2'))
+    >>> sys.path.remove(folder)
+    >>> del sys.modules['pairs_parser']
+    >>> shutil.rmtree(folder)
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m peglet')
+    commands = parser.add_subparsers(dest='command')
+    compiling = commands.add_parser(
+        'compile', help="compile a grammar to a Python module")
+    compiling.add_argument('grammar', help="file holding the grammar")
+    compiling.add_argument('-a', '--actions',
+                           help="module defining the semantic actions")
+    compiling.add_argument('-o', '--output',
+                           help="file to write (default: standard output)")
+    compiling.add_argument('-m', '--memo', default='all',
+                           choices=['all', 'auto', 'none'],
+                           help="which rules to memoize (default: all)")
+    args = parser.parse_args(argv)
+    if args.command != 'compile':
+        parser.print_help()
+        return 2
+    with open(args.grammar) as f: grammar = f.read()
+    source = compile_to_source(grammar, args.actions, args.memo)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(source)
+    else:
+        sys.stdout.write(source)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))